@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.contrib import admin
 from django.urls import include, path
 
@@ -5,3 +6,6 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('foodgram_api.urls'))
 ]
+
+if settings.ASYNC_READ_VIEWS:
+    urlpatterns.insert(1, path('api/', include('foodgram_api.async_urls')))
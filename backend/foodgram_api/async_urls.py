@@ -0,0 +1,17 @@
+from django.urls import path
+
+from .async_views import (ingredient_detail, ingredient_list, recipe_detail,
+                          recipe_list, subscription_list, tag_detail,
+                          tag_list)
+
+# Подключаются перед foodgram_api.urls при ASYNC_READ_VIEWS. Пути, которые
+# здесь не совпали, обслуживают обычные вьюхи.
+urlpatterns = [
+    path('users/subscriptions/', subscription_list),
+    path('recipes/', recipe_list),
+    path('recipes/<int:pk>/', recipe_detail),
+    path('tags/', tag_list),
+    path('tags/<int:pk>/', tag_detail),
+    path('ingredients/', ingredient_list),
+    path('ingredients/<int:pk>/', ingredient_detail),
+]
@@ -0,0 +1,363 @@
+import asyncio
+import contextvars
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial, wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.http import Http404, HttpResponse
+from django.shortcuts import get_object_or_404
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags, quote_etag
+from django_filters.utils import translate_validation
+from rest_framework import exceptions, status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from recipes.models import Ingredient, Recipe, Tag
+from users.models import User
+
+from .caching import (get_recipe_etag, get_table_etag, get_user_flag_queries,
+                      recipe_feed_cache, set_user_flags)
+from .filters import IngredientFilter, RecipeFilter
+from .paginator import CastomPageNumberPagination
+from .search import ingredient_index
+from .serializers import (FollowSerializer, IngredientSerializer,
+                          RecipeReadSerializer, TagSerializer)
+from .utils import get_recipes_limit
+from .views import (IngredientViewSet, RecipeViewSet,
+                    SubscriptionUserViewSet, TagViewSet)
+
+db_executor = ThreadPoolExecutor(
+    max_workers=settings.ASYNC_DB_THREADS, thread_name_prefix='foodgram-db'
+)
+renderer = JSONRenderer()
+
+
+class SyncFallback(Exception):
+    """Запрос обрабатывает синхронная вьюха DRF."""
+
+
+def call_in_thread(func, args):
+    try:
+        return func(*args)
+    finally:
+        close_old_connections()
+
+
+async def run_sync(func, *args):
+    """Выполняет синхронный код с запросами к БД в пуле потоков.
+
+    В Django 3.2 нет асинхронного ORM, поэтому запросы уходят в пул
+    db_executor. У каждого потока пула свое соединение с БД, которое при
+    CONN_MAX_AGE > 0 переиспользуется между запросами. Контекстные
+    переменные, в том числе метрики запроса, копируются в поток.
+    """
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(
+        db_executor, context.run, call_in_thread, func, args
+    )
+
+
+def render(data, status_code=status.HTTP_200_OK):
+    return HttpResponse(
+        renderer.render(data), status=status_code,
+        content_type='application/json'
+    )
+
+
+def error_response(request, exc):
+    """Ответ с ошибкой в том же виде, что у обработчика ошибок DRF."""
+    if isinstance(exc.detail, (list, dict)):
+        data = exc.detail
+    else:
+        data = {'detail': exc.detail}
+    response = render(data, exc.status_code)
+    if isinstance(exc, (
+        exceptions.NotAuthenticated, exceptions.AuthenticationFailed
+    )):
+        header = request.authenticators and (
+            request.authenticators[0].authenticate_header(request)
+        )
+        if header:
+            response['WWW-Authenticate'] = header
+        else:
+            response.status_code = status.HTTP_403_FORBIDDEN
+    return response
+
+
+def authenticate(request):
+    return request.user
+
+
+def get_allowed_methods(fallback):
+    """Заголовок Allow, как у вьюхи DRF с теми же действиями."""
+    view = fallback.cls(**fallback.initkwargs)
+    for method, action in fallback.actions.items():
+        setattr(view, method, getattr(view, action))
+    if hasattr(view, 'get') and not hasattr(view, 'head'):
+        view.head = view.get
+    return ', '.join(view.allowed_methods)
+
+
+def accepts_json(request):
+    """Браузерный API и выбор формата параметром остаются за DRF."""
+    return (
+        'format' not in request.GET
+        and 'text/html' not in request.headers.get('Accept', '')
+    )
+
+
+def async_read_view(fallback):
+    """Асинхронная GET-вьюха с синхронной вьюхой DRF в запасе.
+
+    Асинхронно обрабатываются GET-запросы за JSON. Остальные методы,
+    браузерный API и редкие варианты параметров (курсорная пагинация,
+    несуществующая страница) передаются в fallback, который отвечает
+    так же, как без асинхронных вьюх. Заголовки Allow и Vary такие же,
+    как у fallback.
+    """
+    allow = get_allowed_methods(fallback)
+    fallback = sync_to_async(fallback)
+
+    def decorator(handler):
+        @wraps(handler)
+        async def view(request, *args, **kwargs):
+            if request.method != 'GET' or not accepts_json(request):
+                return await fallback(request, *args, **kwargs)
+            api_request = Request(request, authenticators=[
+                auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES
+            ])
+            try:
+                await run_sync(authenticate, api_request)
+                response = await handler(api_request, *args, **kwargs)
+            except SyncFallback:
+                return await fallback(request, *args, **kwargs)
+            except Http404:
+                response = error_response(api_request, exceptions.NotFound())
+            except exceptions.APIException as exc:
+                response = error_response(api_request, exc)
+            response['Allow'] = allow
+            patch_vary_headers(response, ('Accept',))
+            return response
+
+        # Проверку CSRF для небезопасных методов выполняет DRF в fallback.
+        view.csrf_exempt = True
+        return view
+    return decorator
+
+
+async def conditional_get(request, get_etag, get_data, cache_control):
+    """Ответ с ETag.
+
+    Тег вычисляется раньше данных: если данные изменятся между двумя
+    запросами, клиент получит тег не новее тела ответа и при следующем
+    запросе перечитает его. Данные выбираются только при несовпадении
+    тега с If-None-Match.
+    """
+    if_none_match = parse_etags(request.headers.get('If-None-Match', ''))
+    etag = await run_sync(get_etag)
+    if etag is not None and (
+        quote_etag(etag) in if_none_match or '*' in if_none_match
+    ):
+        response = HttpResponse(status=status.HTTP_304_NOT_MODIFIED)
+    else:
+        response = render(await run_sync(get_data))
+    if etag is not None:
+        response['ETag'] = quote_etag(etag)
+        response['Cache-Control'] = cache_control
+    return response
+
+
+async def paginate(request, queryset, serialize):
+    """Страница по номеру: подсчет строк и выборка идут параллельно."""
+    paginator = CastomPageNumberPagination()
+    page_size = paginator.get_page_size(request)
+    number = request.query_params.get(paginator.page_query_param, '1')
+    if not number.isdigit() or int(number) < 1:
+        raise SyncFallback
+    number = int(number)
+    offset = (number - 1) * page_size
+    count, results = await asyncio.gather(
+        run_sync(queryset.count),
+        run_sync(serialize, queryset[offset:offset + page_size])
+    )
+    if not results and number > 1:
+        raise SyncFallback
+    url = request.build_absolute_uri()
+    query_param = paginator.page_query_param
+    next_link = previous_link = None
+    if offset + page_size < count:
+        next_link = replace_query_param(url, query_param, number + 1)
+    if number == 2:
+        previous_link = remove_query_param(url, query_param)
+    elif number > 2:
+        previous_link = replace_query_param(url, query_param, number - 1)
+    return OrderedDict((
+        ('count', count),
+        ('next', next_link),
+        ('previous', previous_link),
+        ('results', results),
+    ))
+
+
+def filter_queryset(filterset):
+    if not filterset.is_valid():
+        raise translate_validation(filterset.errors)
+    return filterset.qs
+
+
+def serialize(serializer_class, request, queryset, pk=None):
+    """Сериализует весь queryset или один объект из него по pk."""
+    context = {'request': request}
+    if pk is None:
+        return serializer_class(queryset, many=True, context=context).data
+    return serializer_class(
+        get_object_or_404(queryset, pk=pk), context=context
+    ).data
+
+
+def get_cached_page(request):
+    key = recipe_feed_cache.get_key(request)
+    return key, recipe_feed_cache.get(key)
+
+
+async def get_recipe_page(request):
+    queryset = await run_sync(filter_queryset, RecipeFilter(
+        request.query_params,
+        queryset=Recipe.objects.with_user_flags(request.user),
+        request=request
+    ))
+    return await paginate(
+        request, queryset, partial(serialize, RecipeReadSerializer, request)
+    )
+
+
+@async_read_view(RecipeViewSet.as_view({'get': 'list', 'post': 'create'}))
+async def recipe_list(request):
+    """Список рецептов.
+
+    При попадании в кэш анонимных страниц три запроса флагов
+    пользователя выполняются параллельно.
+    """
+    if request.query_params.get('pagination') == 'cursor':
+        raise SyncFallback
+    if not recipe_feed_cache.is_cacheable(request):
+        return render(await get_recipe_page(request))
+    key, payload = await run_sync(get_cached_page, request)
+    if payload is None:
+        payload = await get_recipe_page(request)
+        await run_sync(recipe_feed_cache.set, key, set_user_flags(payload))
+    elif request.user.is_authenticated:
+        queries = get_user_flag_queries(payload, request.user)
+        flags = await asyncio.gather(*(
+            run_sync(set, queryset) for queryset in queries.values()
+        ))
+        payload = set_user_flags(payload, **dict(zip(queries, flags)))
+    return render(payload)
+
+
+@async_read_view(RecipeViewSet.as_view({
+    'get': 'retrieve', 'put': 'update', 'patch': 'partial_update',
+    'delete': 'destroy'
+}))
+async def recipe_detail(request, pk):
+    """Один рецепт."""
+    return await conditional_get(
+        request,
+        partial(get_recipe_etag, pk, request.user),
+        partial(
+            serialize, RecipeReadSerializer, request,
+            Recipe.objects.with_user_flags(request.user), pk
+        ),
+        RecipeViewSet.cache_control
+    )
+
+
+@async_read_view(TagViewSet.as_view({'get': 'list'}))
+async def tag_list(request):
+    """Список тегов."""
+    return await conditional_get(
+        request,
+        partial(get_table_etag, TagViewSet.version_resource),
+        partial(serialize, TagSerializer, request, Tag.objects.all()),
+        TagViewSet.cache_control
+    )
+
+
+@async_read_view(TagViewSet.as_view({'get': 'retrieve'}))
+async def tag_detail(request, pk):
+    """Один тег."""
+    return await conditional_get(
+        request,
+        partial(get_table_etag, TagViewSet.version_resource),
+        partial(serialize, TagSerializer, request, Tag.objects.all(), pk),
+        TagViewSet.cache_control
+    )
+
+
+def list_ingredients(request):
+    name = request.query_params.get('name')
+    if name and settings.INGREDIENT_SEARCH_INDEX:
+        return ingredient_index.search(name)
+    return serialize(IngredientSerializer, request, filter_queryset(
+        IngredientFilter(
+            request.query_params, queryset=Ingredient.objects.all(),
+            request=request
+        )
+    ))
+
+
+@async_read_view(IngredientViewSet.as_view({'get': 'list'}))
+async def ingredient_list(request):
+    """Список ингредиентов с поиском по началу названия."""
+    return await conditional_get(
+        request,
+        partial(get_table_etag, IngredientViewSet.version_resource),
+        partial(list_ingredients, request),
+        IngredientViewSet.cache_control
+    )
+
+
+@async_read_view(IngredientViewSet.as_view({'get': 'retrieve'}))
+async def ingredient_detail(request, pk):
+    """Один ингредиент."""
+    return await conditional_get(
+        request,
+        partial(get_table_etag, IngredientViewSet.version_resource),
+        partial(
+            serialize, IngredientSerializer, request,
+            Ingredient.objects.all(), pk
+        ),
+        IngredientViewSet.cache_control
+    )
+
+
+def serialize_subscriptions(request, authors):
+    authors = list(authors)
+    recipes = Recipe.objects.latest_by_author(
+        [author.id for author in authors], get_recipes_limit(request)
+    )
+    return FollowSerializer(
+        authors, many=True, context={'request': request, 'recipes': recipes}
+    ).data
+
+
+@async_read_view(SubscriptionUserViewSet.as_view({
+    'get': 'list', 'post': 'create'
+}))
+async def subscription_list(request):
+    """Подписки пользователя с превью рецептов авторов."""
+    if not request.user.is_authenticated:
+        raise exceptions.NotAuthenticated
+    if request.query_params.get('pagination') == 'cursor':
+        raise SyncFallback
+    return render(await paginate(
+        request,
+        User.objects.followed_by(request.user),
+        partial(serialize_subscriptions, request)
+    ))
@@ -0,0 +1,110 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.translation import gettext_lazy as _
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+
+# Счетчики меняются запросами UPDATE ... F(), а не через save(), поэтому
+# в кэше их нет: сохранение закэшированного пользователя их не затрет.
+DEFERRED_USER_FIELDS = ('user__recipes_count', 'user__followers_count')
+
+
+class TokenCache:
+    """Кэш токен -> пользователь: LRU в памяти процесса с TTL.
+
+    При TOKEN_CACHE_SHARED записи дополнительно хранятся в общем кэше
+    Django, так что выход из системы или смена пароля в одном процессе
+    видны остальным не позже, чем истечет TTL их локального LRU.
+    """
+
+    prefix = 'auth_token'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get_key(self, key):
+        return f'{self.prefix}:{key}'
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    return entry[1]
+                del self._entries[key]
+        if not settings.TOKEN_CACHE_SHARED:
+            return None
+        token = cache.get(self.get_key(key))
+        if token is not None:
+            self.remember(key, token)
+        return token
+
+    def remember(self, key, token):
+        with self._lock:
+            self._entries[key] = (
+                time.monotonic() + settings.TOKEN_CACHE_TTL, token
+            )
+            self._entries.move_to_end(key)
+            while len(self._entries) > settings.TOKEN_CACHE_SIZE:
+                self._entries.popitem(last=False)
+
+    def set(self, key, token):
+        self.remember(key, token)
+        if settings.TOKEN_CACHE_SHARED:
+            cache.set(self.get_key(key), token, settings.TOKEN_CACHE_TTL)
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+        if settings.TOKEN_CACHE_SHARED and keys:
+            cache.delete_many([self.get_key(key) for key in keys])
+
+    def forget_user(self, user_id):
+        self.delete(*Token.objects.filter(user_id=user_id).values_list(
+            'key', flat=True
+        ))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+token_cache = TokenCache()
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication без запроса к базе для недавно виденных токенов.
+
+    Запись сбрасывается сигналами при удалении токена (выход через
+    token/logout) и при сохранении пользователя (смена пароля,
+    деактивация). Каждому запросу достается своя копия пользователя.
+    """
+
+    def authenticate_credentials(self, key):
+        if settings.TOKEN_CACHE_TTL <= 0:
+            return super().authenticate_credentials(key)
+        token = token_cache.get(key)
+        if token is None:
+            try:
+                token = self.get_model().objects.select_related(
+                    'user'
+                ).defer(*DEFERRED_USER_FIELDS).get(key=key)
+            except self.get_model().DoesNotExist:
+                raise AuthenticationFailed(_('Invalid token.'))
+            if not token.user.is_active:
+                raise AuthenticationFailed(_('User inactive or deleted.'))
+            token_cache.set(key, token)
+        user = copy.copy(token.user)
+        token = copy.copy(token)
+        token.user = user
+        return user, token
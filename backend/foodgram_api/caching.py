@@ -0,0 +1,228 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Exists, OuterRef
+from django.utils.http import parse_etags, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+
+from recipes.models import Favourites, Recipe, ResourceVersion, ShoppingCart
+from users.models import Follow
+
+
+class NotModified(Exception):
+    pass
+
+
+class ConditionalGetMixin:
+    """Условные GET-запросы (ETag / If-None-Match) для вьюсетов.
+
+    Тег вычисляется в get_etag() до обращения к queryset и сериализатору.
+    Если он совпадает с присланным клиентом, сразу отдается 304.
+    """
+
+    cache_control = 'no-cache'
+
+    def get_etag(self):
+        return None
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self.etag = None
+        if request.method not in ('GET', 'HEAD'):
+            return
+        etag = self.get_etag()
+        if etag is None:
+            return
+        self.etag = quote_etag(etag)
+        if_none_match = parse_etags(request.headers.get('If-None-Match', ''))
+        if self.etag in if_none_match or '*' in if_none_match:
+            raise NotModified
+
+    def handle_exception(self, exc):
+        if isinstance(exc, NotModified):
+            return Response(status=status.HTTP_304_NOT_MODIFIED)
+        return super().handle_exception(exc)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(
+            request, response, *args, **kwargs
+        )
+        if getattr(self, 'etag', None) and response.status_code in (
+            status.HTTP_200_OK, status.HTTP_304_NOT_MODIFIED
+        ):
+            response['ETag'] = self.etag
+            response['Cache-Control'] = self.cache_control
+        return response
+
+
+class TableVersionETagMixin(ConditionalGetMixin):
+    """ETag по версии таблицы, которую увеличивают сигналы моделей."""
+
+    cache_control = 'public, no-cache'
+    version_resource = None
+
+    def get_etag(self):
+        return get_table_etag(self.version_resource)
+
+
+def get_table_etag(resource):
+    version, = ResourceVersion.objects.get_versions(resource)
+    return f'{resource}-{version}'
+
+
+def get_recipe_etag(pk, user):
+    """ETag рецепта одним запросом.
+
+    Учитывает версию рецепта, версии тегов и ингредиентов, данные автора и
+    флаги текущего пользователя. Возвращает None, если рецепта нет.
+    """
+    queryset = Recipe.objects.filter(pk=pk).annotate_user_flags(user)
+    if user.is_authenticated:
+        queryset = queryset.annotate(author_is_subscribed=Exists(
+            Follow.objects.filter(user=user, author=OuterRef('author'))
+        ))
+    state = queryset.values_list(
+        'version', 'author__email', 'author__username',
+        'author__first_name', 'author__last_name',
+        'is_favorited', 'is_in_shopping_cart',
+        *(('author_is_subscribed',) if user.is_authenticated else ())
+    ).first()
+    if state is None:
+        return None
+    versions = ResourceVersion.objects.get_versions('tags', 'ingredients')
+    digest = hashlib.md5(repr((state, versions)).encode()).hexdigest()
+    return f'recipe-{pk}-{digest}'
+
+
+class RecipeFeedCache:
+    """Кэш страниц списка рецептов в том виде, в каком их видит аноним.
+
+    Ключ строится по хосту и параметрам запроса, а также по номеру
+    поколения: любое изменение рецептов, их ингредиентов, тегов или
+    авторов увеличивает поколение, и старые страницы перестают читаться.
+    Запросы с фильтрами is_favorited и is_in_shopping_cart зависят от
+    пользователя и не кэшируются. Не кэшируется и сортировка по
+    favourites_count: счетчик меняется при каждом добавлении в избранное,
+    а сбрасывать из-за него весь кэш слишком дорого.
+    """
+
+    prefix = 'recipe_feed'
+    user_filters = ('is_favorited', 'is_in_shopping_cart')
+    volatile_ordering = 'favourites_count'
+
+    def is_enabled(self):
+        return settings.RECIPE_FEED_CACHE_TIMEOUT > 0
+
+    def is_cacheable(self, request):
+        if not self.is_enabled():
+            return False
+        if self.volatile_ordering in request.query_params.get('ordering', ''):
+            return False
+        if request.user.is_anonymous:
+            return True
+        return not any(
+            request.query_params.get(name) in ('1', 'true', 'True')
+            for name in self.user_filters
+        )
+
+    def get_key(self, request):
+        generation = cache.get(f'{self.prefix}:generation', 0)
+        params = sorted(
+            (key, value)
+            for key, values in request.query_params.lists()
+            for value in values
+        )
+        digest = hashlib.md5(
+            repr((request.get_host(), request.path, params)).encode()
+        ).hexdigest()
+        return f'{self.prefix}:{generation}:{digest}'
+
+    def get(self, key):
+        payload = cache.get(key)
+        self.count('hits' if payload is not None else 'misses')
+        return payload
+
+    def set(self, key, payload):
+        cache.set(key, payload, settings.RECIPE_FEED_CACHE_TIMEOUT)
+
+    def invalidate(self):
+        self.increment(f'{self.prefix}:generation')
+
+    def count(self, name):
+        self.increment(f'{self.prefix}:{name}')
+
+    def increment(self, key):
+        try:
+            cache.incr(key)
+        except ValueError:
+            if not cache.add(key, 1, timeout=None):
+                cache.incr(key)
+
+    def get_stats(self):
+        stats = cache.get_many(
+            [f'{self.prefix}:hits', f'{self.prefix}:misses']
+        )
+        hits = stats.get(f'{self.prefix}:hits', 0)
+        misses = stats.get(f'{self.prefix}:misses', 0)
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_ratio': hits / (hits + misses) if hits + misses else None,
+            'generation': cache.get(f'{self.prefix}:generation', 0),
+        }
+
+
+recipe_feed_cache = RecipeFeedCache()
+
+
+def set_user_flags(payload, favorited=(), in_cart=(), followed=()):
+    """Копия страницы рецептов с заданными флагами пользователя."""
+    return {
+        **payload,
+        'results': [
+            {
+                **recipe,
+                'author': {
+                    **recipe['author'],
+                    'is_subscribed': recipe['author']['id'] in followed,
+                },
+                'is_favorited': recipe['id'] in favorited,
+                'is_in_shopping_cart': recipe['id'] in in_cart,
+            }
+            for recipe in payload['results']
+        ],
+    }
+
+
+def get_user_flag_queries(payload, user):
+    """Запросы флагов пользователя для страницы рецептов.
+
+    Запросы независимы друг от друга и могут выполняться параллельно.
+    """
+    recipe_ids = [recipe['id'] for recipe in payload['results']]
+    author_ids = {recipe['author']['id'] for recipe in payload['results']}
+    return {
+        'favorited': Favourites.objects.filter(
+            user=user, recipe_id__in=recipe_ids
+        ).values_list('recipe_id', flat=True),
+        'in_cart': ShoppingCart.objects.filter(
+            user=user, recipe_id__in=recipe_ids
+        ).values_list('recipe_id', flat=True),
+        'followed': Follow.objects.filter(
+            user=user, author_id__in=author_ids
+        ).values_list('author_id', flat=True),
+    }
+
+
+def add_user_flags(payload, user):
+    """Дополняет анонимную страницу рецептов флагами пользователя.
+
+    Три коротких запроса по id рецептов и авторов страницы вместо полной
+    сериализации.
+    """
+    return set_user_flags(payload, **{
+        name: set(queryset)
+        for name, queryset in get_user_flag_queries(payload, user).items()
+    })
@@ -0,0 +1,231 @@
+import csv
+import io
+import json
+import os
+from abc import ABC, abstractmethod
+from itertools import islice
+
+from django.conf import settings
+from django.db.models import F
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+from recipes.models import ShoppingListItem
+
+CHUNK_SIZE = 500
+SHOPPING_LIST_TITLE = 'Список покупок:'
+
+
+def get_shopping_list(user):
+    """Список ингредиентов из корзины пользователя.
+
+    Суммы хранятся в ShoppingListItem и поддерживаются при изменении
+    корзины и рецептов, поэтому выгрузка - это чтение по индексу.
+    """
+    return ShoppingListItem.objects.filter(user=user).values(
+        'ingredient__name', 'ingredient__measurement_unit',
+        ingredient_amount=F('amount')
+    ).order_by('ingredient__name', 'ingredient__measurement_unit')
+
+
+def chunked(rows, size=CHUNK_SIZE):
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class ShoppingListExporter(ABC):
+    """Базовый класс выгрузки списка покупок."""
+
+    format = None
+    content_type = None
+    extension = None
+
+    @abstractmethod
+    def stream(self, rows):
+        """Итератор частей файла по строкам списка покупок."""
+
+
+class ChunkedExporter(ShoppingListExporter):
+    """Выгрузка по частям.
+
+    Строки читаются из курсора пачками по CHUNK_SIZE, и каждая пачка
+    отдается клиенту сразу после форматирования.
+    """
+
+    def header(self):
+        return ''
+
+    @abstractmethod
+    def render_chunk(self, chunk, first):
+        """Форматирует пачку строк; first - первая ли это пачка."""
+
+    def footer(self):
+        return ''
+
+    def stream(self, rows):
+        yield self.header()
+        for number, chunk in enumerate(chunked(rows)):
+            yield self.render_chunk(chunk, first=number == 0)
+        yield self.footer()
+
+
+class TextExporter(ChunkedExporter):
+    format = 'txt'
+    content_type = 'text/plain; charset=utf-8'
+    extension = 'txt'
+
+    def header(self):
+        return f'{SHOPPING_LIST_TITLE}\n\n'
+
+    def render_chunk(self, chunk, first):
+        return ''.join(
+            f'- {row["ingredient__name"]}'
+            f'({row["ingredient__measurement_unit"]})'
+            f' - {row["ingredient_amount"]}\n'
+            for row in chunk
+        )
+
+
+class CsvExporter(ChunkedExporter):
+    format = 'csv'
+    content_type = 'text/csv; charset=utf-8'
+    extension = 'csv'
+
+    def write(self, rows):
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        return buffer.getvalue()
+
+    def header(self):
+        return self.write((('name', 'measurement_unit', 'amount'),))
+
+    def render_chunk(self, chunk, first):
+        return self.write(
+            (
+                row['ingredient__name'],
+                row['ingredient__measurement_unit'],
+                row['ingredient_amount']
+            )
+            for row in chunk
+        )
+
+
+class JsonExporter(ChunkedExporter):
+    format = 'json'
+    content_type = 'application/json'
+    extension = 'json'
+
+    def header(self):
+        return '['
+
+    def render_chunk(self, chunk, first):
+        items = ','.join(
+            json.dumps(
+                {
+                    'name': row['ingredient__name'],
+                    'measurement_unit': row['ingredient__measurement_unit'],
+                    'amount': row['ingredient_amount'],
+                },
+                ensure_ascii=False
+            )
+            for row in chunk
+        )
+        return items if first else f',{items}'
+
+    def footer(self):
+        return ']'
+
+
+class PdfExporter(ShoppingListExporter):
+    """Выгрузка в PDF.
+
+    Страницы рисуются по мере чтения строк из курсора, но файл отдается
+    целиком: таблица ссылок PDF известна только после последней страницы.
+    """
+
+    format = 'pdf'
+    content_type = 'application/pdf'
+    extension = 'pdf'
+    font_name = 'ShoppingListFont'
+    font_size = 12
+    margin = 50
+
+    def get_font(self):
+        if self.font_name in pdfmetrics.getRegisteredFontNames():
+            return self.font_name
+        path = settings.SHOPPING_LIST_PDF_FONT
+        if not os.path.isfile(path):
+            return 'Helvetica'
+        pdfmetrics.registerFont(TTFont(self.font_name, path))
+        return self.font_name
+
+    def stream(self, rows):
+        buffer = io.BytesIO()
+        pdf = canvas.Canvas(buffer, pagesize=A4)
+        font = self.get_font()
+        _, height = A4
+        line_height = self.font_size * 1.5
+        pdf.setFont(font, self.font_size + 4)
+        pdf.drawString(self.margin, height - self.margin, SHOPPING_LIST_TITLE)
+        y = height - self.margin - line_height * 2
+        pdf.setFont(font, self.font_size)
+        for row in rows:
+            if y < self.margin:
+                pdf.showPage()
+                pdf.setFont(font, self.font_size)
+                y = height - self.margin
+            pdf.drawString(
+                self.margin, y,
+                f'- {row["ingredient__name"]} '
+                f'({row["ingredient__measurement_unit"]})'
+                f' - {row["ingredient_amount"]}'
+            )
+            y -= line_height
+        pdf.save()
+        yield buffer.getvalue()
+
+
+EXPORTERS = {
+    exporter.format: exporter
+    for exporter in (TextExporter, CsvExporter, JsonExporter, PdfExporter)
+}
+
+
+class ShoppingListRenderer(BaseRenderer):
+    """Рендерер формата выгрузки.
+
+    По media_type и format DRF выбирает выгрузку из заголовка Accept или
+    параметра ?format=. Сама выгрузка отдается потоковым ответом, а через
+    рендерер проходят только ошибки (например, 401), и они отдаются в JSON.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        response = (renderer_context or {}).get('response')
+        if response is not None:
+            response['Content-Type'] = JSONRenderer.media_type
+        return JSONRenderer().render(data, renderer_context=renderer_context)
+
+
+def get_renderer(exporter):
+    media_type, _, charset = exporter.content_type.partition('; charset=')
+    return type(
+        exporter.__name__.replace('Exporter', 'Renderer'),
+        (ShoppingListRenderer,),
+        {
+            'media_type': media_type,
+            'format': exporter.format,
+            'charset': charset or None,
+        }
+    )
+
+
+SHOPPING_LIST_RENDERERS = tuple(
+    get_renderer(exporter) for exporter in EXPORTERS.values()
+)
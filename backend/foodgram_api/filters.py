@@ -19,6 +19,11 @@ class RecipeFilter(FilterSet):
     is_in_shopping_cart = filters.BooleanFilter(
         method='get_is_in_shopping_cart'
     )
+    search = filters.CharFilter(method='get_search')
+    ordering = filters.OrderingFilter(
+        fields=(('favourites_count', 'favourites_count'),),
+        method='get_ordering'
+    )
 
     class Meta:
         model = Recipe
@@ -34,6 +39,14 @@ class RecipeFilter(FilterSet):
             return queryset.filter(shoppingcart_recipe__user=self.request.user)
         return queryset
 
+    def get_search(self, queryset, name, value):
+        """Полнотекстовый поиск по названию, ингредиентам и описанию."""
+        return queryset.search(value)
+
+    def get_ordering(self, queryset, name, value):
+        """Сортировка по популярности, при равенстве - новые выше."""
+        return queryset.order_by(*value, '-id')
+
 
 class IngredientFilter(FilterSet):
     name = filters.CharFilter(lookup_expr='istartswith')
@@ -41,3 +54,15 @@ class IngredientFilter(FilterSet):
     class Meta:
         model = Ingredient
         fields = ('name',)
+
+
+class UserFilter(FilterSet):
+    search = filters.CharFilter(method='get_search')
+
+    class Meta:
+        model = User
+        fields = ('search',)
+
+    def get_search(self, queryset, name, value):
+        """Поиск по подстроке в логине, имени и фамилии."""
+        return queryset.search(value)
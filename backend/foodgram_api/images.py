@@ -0,0 +1,171 @@
+import base64
+import hashlib
+import io
+import logging
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.db import close_old_connections
+from django.db.models import F
+from PIL import Image, ImageOps, UnidentifiedImageError
+from rest_framework import serializers
+
+from recipes.models import Recipe
+
+from .caching import recipe_feed_cache
+
+logger = logging.getLogger(__name__)
+
+# Кратно 4 символам base64, чтобы каждый кусок декодировался отдельно.
+DECODE_CHUNK_SIZE = 64 * 1024
+SPOOL_MAX_SIZE = 1024 * 1024
+
+
+def decode_base64_image(data):
+    """Декодирует data:image/...;base64 по частям во временный файл.
+
+    Размер проверяется до декодирования и по ходу записи, поэтому
+    слишком большая картинка отклоняется, не попадая в память целиком.
+    Имя файла - хэш содержимого.
+    """
+    header, _, encoded = data.partition(';base64,')
+    if not encoded:
+        raise serializers.ValidationError('Некорректная картинка!')
+    ext = header.split('/')[-1].lower()
+    max_size = settings.RECIPE_IMAGE_MAX_UPLOAD_SIZE
+    if len(encoded) * 3 // 4 > max_size + 2:
+        raise serializers.ValidationError(
+            f'Размер картинки не может превышать {max_size} байт!'
+        )
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        for start in range(0, len(encoded), DECODE_CHUNK_SIZE):
+            chunk = base64.b64decode(
+                encoded[start:start + DECODE_CHUNK_SIZE]
+            )
+            size += len(chunk)
+            if size > max_size:
+                raise serializers.ValidationError(
+                    f'Размер картинки не может превышать {max_size} байт!'
+                )
+            digest.update(chunk)
+            spool.write(chunk)
+    except ValueError:
+        spool.close()
+        raise serializers.ValidationError('Некорректная картинка!')
+    except serializers.ValidationError:
+        spool.close()
+        raise
+    spool.seek(0)
+    return File(spool, name=f'{digest.hexdigest()[:32]}.{ext}')
+
+
+def validate_dimensions(image_file):
+    """Проверяет размеры картинки по заголовку, не декодируя пиксели."""
+    max_dimension = settings.RECIPE_IMAGE_MAX_DIMENSION
+    try:
+        with Image.open(image_file) as image:
+            width, height = image.size
+    except (UnidentifiedImageError, Image.DecompressionBombError):
+        raise serializers.ValidationError('Некорректная картинка!')
+    finally:
+        image_file.seek(0)
+    if max(width, height) > max_dimension:
+        raise serializers.ValidationError(
+            'Сторона картинки не может быть больше '
+            f'{max_dimension} пикселей!'
+        )
+
+
+def variant_name(name, variant):
+    """Путь к варианту картинки: имя оригинала с суффиксом варианта."""
+    directory, filename = os.path.split(name)
+    stem = os.path.splitext(filename)[0]
+    return os.path.join(directory, 'variants', f'{stem}_{variant}.webp')
+
+
+def render_variant(image, size):
+    variant = image.copy()
+    variant.thumbnail(size)
+    buffer = io.BytesIO()
+    variant.save(
+        buffer, 'WEBP', quality=settings.RECIPE_IMAGE_WEBP_QUALITY
+    )
+    return buffer.getvalue()
+
+
+def generate_variants(name):
+    """Создает недостающие варианты картинки и отмечает рецепты с ней.
+
+    Версия рецепта увеличивается, чтобы ETag и кэш ленты подхватили
+    новые адреса картинок.
+    """
+    field = Recipe._meta.get_field('image')
+    storage = field.storage
+    missing = {
+        variant: size
+        for variant, size in settings.RECIPE_IMAGE_VARIANTS.items()
+        if not storage.exists(variant_name(name, variant))
+    }
+    if missing:
+        with storage.open(name) as original, Image.open(original) as image:
+            image = ImageOps.exif_transpose(image)
+            if image.mode not in ('RGB', 'RGBA'):
+                image = image.convert('RGBA')
+            for variant, size in missing.items():
+                storage.save_derived(
+                    variant_name(name, variant),
+                    ContentFile(render_variant(image, size))
+                )
+    updated = Recipe.objects.filter(
+        image=name, has_image_variants=False
+    ).update(has_image_variants=True, version=F('version') + 1)
+    if updated:
+        recipe_feed_cache.invalidate()
+
+
+class ImagePipeline:
+    """Фоновая обработка загруженных картинок рецептов.
+
+    Запрос завершается сразу после сохранения оригинала, а варианты
+    создаются в пуле потоков из RECIPE_IMAGE_WORKERS потоков. При нуле
+    потоков обработка выполняется сразу в вызывающем потоке.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def get_executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=settings.RECIPE_IMAGE_WORKERS,
+                        thread_name_prefix='recipe-images'
+                    )
+        return self._executor
+
+    def process(self, name):
+        try:
+            generate_variants(name)
+        except Exception:
+            logger.exception('Не удалось обработать картинку %s', name)
+        finally:
+            close_old_connections()
+
+    def submit(self, name):
+        if not settings.RECIPE_IMAGE_WORKERS:
+            generate_variants(name)
+            return
+        self.get_executor().submit(self.process, name)
+
+
+image_pipeline = ImagePipeline()
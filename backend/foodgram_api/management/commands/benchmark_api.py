@@ -0,0 +1,459 @@
+import base64
+import io
+import logging
+import math
+import random
+import tempfile
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import (CaptureQueriesContext, setup_test_environment,
+                               teardown_test_environment)
+from PIL import Image
+from rest_framework.authtoken.models import Token
+
+from recipes.models import (Favourites, Ingredient, IngredientsInRecipe,
+                            Recipe, ShoppingCart, Tag)
+from users.models import Follow, User
+
+DEFAULT_INGREDIENTS = Path(settings.BASE_DIR).parent / 'data/ingredients.csv'
+BATCH_SIZE = 1000
+BATCH_SIZE_BENCHMARK = 20
+NOT_MODIFIED = '-not-modified'
+PASSWORD = 'benchmark-password'
+TAGS = (
+    ('Завтрак', '#E26C2D', 'breakfast'),
+    ('Обед', '#49B64E', 'lunch'),
+    ('Ужин', '#8775D2', 'dinner'),
+)
+
+# Сценарии: имя, метод, путь, авторизация, ожидаемый статус,
+# бюджет SQL-запросов. Авторизация: None - аноним, 'user' - основной
+# пользователь бенчмарка, 'session' - токен, полученный при логине.
+# Сценарии с суффиксом -not-modified повторяют запрос сценария без
+# суффикса с его ETag в заголовке If-None-Match.
+CASES = (
+    ('recipes-list-anonymous', 'get', '/api/recipes/', None, 200, 5),
+    ('recipes-list', 'get', '/api/recipes/', 'user', 200, 6),
+    ('recipes-list-limit', 'get', '/api/recipes/?limit=50', 'user', 200, 5),
+    ('recipes-list-cursor', 'get', '/api/recipes/?pagination=cursor',
+     'user', 200, 4),
+    ('recipes-list-filtered', 'get',
+     '/api/recipes/?tags=breakfast&tags=lunch&author={author}',
+     'user', 200, 7),
+    ('recipes-search', 'get', '/api/recipes/?search=мука', 'user', 200, 5),
+    ('recipes-feed', 'get', '/api/recipes/feed/', 'user', 200, 6),
+    ('recipes-what-to-cook', 'get',
+     '/api/recipes/what_to_cook/?ingredients={pantry}', 'user', 200, 5),
+    ('recipes-list-favorited', 'get', '/api/recipes/?is_favorited=1',
+     'user', 200, 5),
+    ('recipes-list-in-cart', 'get', '/api/recipes/?is_in_shopping_cart=1',
+     'user', 200, 5),
+    ('recipes-detail', 'get', '/api/recipes/{recipe}/', 'user', 200, 6),
+    ('recipes-detail-not-modified', 'get', '/api/recipes/{recipe}/',
+     'user', 304, 2),
+    ('recipes-create', 'post', '/api/recipes/', 'user', 201, 19),
+    ('recipes-update', 'patch', '/api/recipes/{created}/', 'user', 200, 19),
+    ('recipes-delete', 'delete', '/api/recipes/{created}/', 'user', 204, 12),
+    ('favorite-create', 'post', '/api/recipes/{recipe}/favorite/',
+     'user', 201, 4),
+    ('favorite-delete', 'delete', '/api/recipes/{recipe}/favorite/',
+     'user', 204, 3),
+    ('shopping-cart-create', 'post', '/api/recipes/{recipe}/shopping_cart/',
+     'user', 201, 6),
+    ('shopping-cart-delete', 'delete',
+     '/api/recipes/{recipe}/shopping_cart/', 'user', 204, 5),
+    ('favorite-batch-create', 'post', '/api/recipes/favorite/',
+     'user', 200, 4),
+    ('favorite-batch-delete', 'delete', '/api/recipes/favorite/',
+     'user', 200, 4),
+    ('shopping-cart-batch-create', 'post', '/api/recipes/shopping_cart/',
+     'user', 200, 9),
+    ('shopping-cart-batch-delete', 'delete', '/api/recipes/shopping_cart/',
+     'user', 200, 9),
+    ('download-shopping-cart', 'get', '/api/recipes/download_shopping_cart/',
+     'user', 200, 1),
+    ('download-shopping-cart-csv', 'get',
+     '/api/recipes/download_shopping_cart/?format=csv', 'user', 200, 1),
+    ('download-shopping-cart-json', 'get',
+     '/api/recipes/download_shopping_cart/?format=json', 'user', 200, 1),
+    ('download-shopping-cart-pdf', 'get',
+     '/api/recipes/download_shopping_cart/?format=pdf', 'user', 200, 1),
+    ('subscriptions', 'get', '/api/users/subscriptions/?recipes_limit=3',
+     'user', 200, 3),
+    ('subscriptions-limit', 'get',
+     '/api/users/subscriptions/?limit=20&recipes_limit=3', 'user', 200, 3),
+    ('subscribe-create', 'post', '/api/users/{author}/subscribe/',
+     'user', 201, 7),
+    ('subscribe-delete', 'delete', '/api/users/{author}/subscribe/',
+     'user', 204, 4),
+    ('subscribe-batch-create', 'post', '/api/users/subscribe/',
+     'user', 200, 6),
+    ('subscribe-batch-delete', 'delete', '/api/users/subscribe/',
+     'user', 200, 5),
+    ('users-list', 'get', '/api/users/', 'user', 200, 2),
+    ('users-list-limit', 'get', '/api/users/?limit=50', 'user', 200, 2),
+    ('users-search', 'get', '/api/users/?search=user1', 'user', 200, 2),
+    ('users-detail', 'get', '/api/users/{author}/', 'user', 200, 1),
+    ('users-me', 'get', '/api/users/me/', 'user', 200, 0),
+    ('ingredients-list', 'get', '/api/ingredients/', None, 200, 2),
+    ('ingredients-list-not-modified', 'get', '/api/ingredients/',
+     None, 304, 1),
+    ('ingredients-search', 'get', '/api/ingredients/?name=мо', None, 200, 2),
+    ('ingredients-detail', 'get', '/api/ingredients/{ingredient}/',
+     None, 200, 2),
+    ('tags-list', 'get', '/api/tags/', None, 200, 2),
+    ('tags-list-not-modified', 'get', '/api/tags/', None, 304, 1),
+    ('tags-detail', 'get', '/api/tags/{tag}/', None, 200, 2),
+    ('token-login', 'post', '/api/auth/token/login/', None, 200, 5),
+    ('token-logout', 'post', '/api/auth/token/logout/', 'session', 204, 4),
+)
+
+
+def percentile(values, percent):
+    """Перцентиль по методу ближайшего ранга."""
+    ordered = sorted(values)
+    index = max(math.ceil(percent / 100 * len(ordered)) - 1, 0)
+    return ordered[index]
+
+
+class Command(BaseCommand):
+    help = (
+        'Заполняет тестовую базу синтетическими данными и измеряет '
+        'количество SQL-запросов, время и размер ответа для каждого '
+        'эндпоинта API. Завершается с ошибкой при превышении бюджета '
+        'запросов.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=2000)
+        parser.add_argument('--recipes', type=int, default=20000)
+        parser.add_argument('--favourites-per-user', type=int, default=10)
+        parser.add_argument('--cart-size', type=int, default=50)
+        parser.add_argument('--follows-per-user', type=int, default=10)
+        parser.add_argument('--iterations', type=int, default=20)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--ingredients', default=str(DEFAULT_INGREDIENTS),
+            help='CSV-файл с ингредиентами (название, единица измерения).'
+        )
+        parser.add_argument(
+            '--keepdb', action='store_true',
+            help='Не удалять тестовую базу и переиспользовать её данные.'
+        )
+        parser.add_argument(
+            '--only', nargs='*', default=(),
+            help='Запустить только сценарии с указанными именами.'
+        )
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        # Строки лога метрик на каждый запрос заглушили бы отчет.
+        logging.getLogger('foodgram_api.metrics').setLevel(logging.WARNING)
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(
+            verbosity=0, keepdb=options['keepdb'], serialize=False
+        )
+        try:
+            with tempfile.TemporaryDirectory() as media_root:
+                with override_settings(MEDIA_ROOT=media_root):
+                    if not Recipe.objects.exists():
+                        self.seed(options)
+                    results = self.run_cases(options)
+        finally:
+            connection.creation.destroy_test_db(
+                old_name, verbosity=0, keepdb=options['keepdb']
+            )
+            teardown_test_environment()
+        self.report(results)
+
+    def seed(self, options):
+        started = time.perf_counter()
+        self.seed_ingredients(options['ingredients'])
+        Tag.objects.bulk_create(
+            Tag(name=name, color=color, slug=slug)
+            for name, color, slug in TAGS
+        )
+        password = make_password(PASSWORD)
+        User.objects.bulk_create(
+            (
+                User(
+                    username=f'user{number}',
+                    email=f'user{number}@example.com',
+                    first_name='Имя',
+                    last_name='Фамилия',
+                    password=password
+                )
+                for number in range(options['users'])
+            ),
+            batch_size=BATCH_SIZE
+        )
+        user_ids = list(User.objects.values_list('id', flat=True))
+        self.seed_recipes(user_ids, options['recipes'])
+        recipe_ids = list(Recipe.objects.values_list('id', flat=True))
+        for model, per_user in (
+            (Favourites, options['favourites_per_user']),
+            (ShoppingCart, options['favourites_per_user']),
+        ):
+            model.objects.bulk_create(
+                (
+                    model(user_id=user_id, recipe_id=recipe_id)
+                    for user_id in user_ids
+                    for recipe_id in self.random.sample(
+                        recipe_ids, min(per_user, len(recipe_ids))
+                    )
+                ),
+                batch_size=BATCH_SIZE
+            )
+        Follow.objects.bulk_create(
+            (
+                Follow(user_id=user_id, author_id=author_id)
+                for user_id in user_ids
+                for author_id in self.random.sample(
+                    user_ids, min(options['follows_per_user'] + 1,
+                                  len(user_ids))
+                )
+                if author_id != user_id
+            ),
+            batch_size=BATCH_SIZE
+        )
+        bench_user = User.objects.order_by('id').first()
+        in_cart = set(ShoppingCart.objects.filter(
+            user=bench_user
+        ).values_list('recipe_id', flat=True))
+        ShoppingCart.objects.bulk_create(
+            ShoppingCart(user=bench_user, recipe_id=recipe_id)
+            for recipe_id in self.random.sample(
+                recipe_ids, min(options['cart_size'], len(recipe_ids))
+            )
+            if recipe_id not in in_cart
+        )
+        call_command('rebuild_shopping_lists', stdout=self.stdout)
+        call_command('reconcile_counters', stdout=self.stdout)
+        call_command('rebuild_search_index', stdout=self.stdout)
+        call_command('rebuild_timelines', stdout=self.stdout)
+        self.stdout.write(
+            f'Данные созданы за {time.perf_counter() - started:.1f} с: '
+            f'{len(user_ids)} пользователей, {len(recipe_ids)} рецептов, '
+            f'{Ingredient.objects.count()} ингредиентов.'
+        )
+
+    def seed_ingredients(self, path):
+        call_command('load_ingredients', path, stdout=self.stdout)
+
+    def seed_recipes(self, user_ids, count):
+        Recipe.objects.bulk_create(
+            (
+                Recipe(
+                    author_id=self.random.choice(user_ids),
+                    name=f'Рецепт {number}',
+                    text='Описание рецепта. ' * 20,
+                    image='recipes/benchmark.png',
+                    cooking_time=self.random.randint(1, 120)
+                )
+                for number in range(count)
+            ),
+            batch_size=BATCH_SIZE
+        )
+        ingredient_ids = list(Ingredient.objects.values_list('id', flat=True))
+        tag_ids = list(Tag.objects.values_list('id', flat=True))
+        recipe_ids = Recipe.objects.values_list('id', flat=True).iterator()
+        RecipeTag = Recipe.tags.through
+        ingredients_batch, tags_batch = [], []
+        for recipe_id in recipe_ids:
+            ingredients_batch.extend(
+                IngredientsInRecipe(
+                    recipe_id=recipe_id,
+                    ingredient_id=ingredient_id,
+                    amount=self.random.randint(1, 500)
+                )
+                for ingredient_id in self.random.sample(
+                    ingredient_ids, self.random.randint(3, 10)
+                )
+            )
+            tags_batch.extend(
+                RecipeTag(recipe_id=recipe_id, tag_id=tag_id)
+                for tag_id in self.random.sample(
+                    tag_ids, self.random.randint(1, len(tag_ids))
+                )
+            )
+            if len(ingredients_batch) >= BATCH_SIZE:
+                IngredientsInRecipe.objects.bulk_create(ingredients_batch)
+                RecipeTag.objects.bulk_create(tags_batch)
+                ingredients_batch, tags_batch = [], []
+        IngredientsInRecipe.objects.bulk_create(ingredients_batch)
+        RecipeTag.objects.bulk_create(tags_batch)
+
+    def prepare_state(self):
+        """Выбирает объекты, с которыми работают сценарии."""
+        user = User.objects.order_by('id').first()
+        session_user = User.objects.order_by('id')[1]
+        followed = Follow.objects.filter(user=user).values('author_id')
+        buffer = io.BytesIO()
+        Image.new('RGB', (64, 64), '#E26C2D').save(buffer, 'PNG')
+        image = base64.b64encode(buffer.getvalue()).decode()
+        return {
+            'user': user,
+            'token': Token.objects.get_or_create(user=user)[0].key,
+            'session_email': session_user.email,
+            'session': None,
+            'recipe': Recipe.objects.exclude(
+                favourites_recipe__user=user
+            ).exclude(shoppingcart_recipe__user=user).first().id,
+            'author': User.objects.exclude(pk=user.pk).exclude(
+                pk__in=followed
+            ).first().id,
+            'batch_recipes': list(Recipe.objects.exclude(
+                favourites_recipe__user=user
+            ).exclude(shoppingcart_recipe__user=user).order_by(
+                '-id'
+            ).values_list('id', flat=True)[:BATCH_SIZE_BENCHMARK]),
+            'batch_authors': list(User.objects.exclude(pk=user.pk).exclude(
+                pk__in=followed
+            ).order_by('-id').values_list('id', flat=True)[
+                :BATCH_SIZE_BENCHMARK
+            ]),
+            'created': None,
+            'etags': {},
+            'ingredient': Ingredient.objects.first().id,
+            'ingredient_ids': list(
+                Ingredient.objects.values_list('id', flat=True)[:30]
+            ),
+            'pantry': ','.join(
+                str(ingredient_id) for ingredient_id in self.random.sample(
+                    list(Ingredient.objects.values_list('id', flat=True)), 50
+                )
+            ),
+            'tag': Tag.objects.first().id,
+            'tag_ids': list(Tag.objects.values_list('id', flat=True)),
+            'image': f'data:image/png;base64,{image}',
+        }
+
+    def get_payload(self, name, state):
+        if name in ('recipes-create', 'recipes-update'):
+            size = 10 if name == 'recipes-create' else 12
+            return {
+                'ingredients': [
+                    {'id': ingredient_id, 'amount': 10}
+                    for ingredient_id in self.random.sample(
+                        state['ingredient_ids'], size
+                    )
+                ],
+                'tags': state['tag_ids'],
+                'image': state['image'],
+                'name': f'Рецепт бенчмарка ({name})',
+                'text': 'Описание рецепта.',
+                'cooking_time': 15,
+            }
+        if '-batch-' in name:
+            key = 'batch_authors' if name.startswith('subscribe') else (
+                'batch_recipes'
+            )
+            return {'ids': state[key]}
+        if name == 'token-login':
+            return {'email': state['session_email'], 'password': PASSWORD}
+        return None
+
+    def run_cases(self, options):
+        state = self.prepare_state()
+        cases = [
+            case for case in CASES
+            if not options['only'] or case[0] in options['only']
+        ]
+        results = {
+            case[0]: {
+                'queries': [], 'times': [], 'bytes': [], 'status': [],
+                'sql': None
+            }
+            for case in cases
+        }
+        client = Client()
+        # Бюджеты рассчитаны на прогретый кэш токенов, как у живого клиента.
+        client.get(
+            '/api/users/me/', HTTP_AUTHORIZATION=f'Token {state["token"]}'
+        )
+        for _ in range(options['iterations']):
+            for name, method, path, auth, expected, budget in cases:
+                headers = {}
+                if auth == 'user':
+                    headers['HTTP_AUTHORIZATION'] = f'Token {state["token"]}'
+                elif auth == 'session':
+                    headers['HTTP_AUTHORIZATION'] = (
+                        f'Token {state["session"]}'
+                    )
+                if name.endswith(NOT_MODIFIED):
+                    headers['HTTP_IF_NONE_MATCH'] = state['etags'].get(
+                        name[:-len(NOT_MODIFIED)], ''
+                    )
+                payload = self.get_payload(name, state)
+                url = path.format(**state)
+                with CaptureQueriesContext(connection) as queries:
+                    started = time.perf_counter()
+                    response = getattr(client, method)(
+                        url, payload, content_type='application/json',
+                        **headers
+                    ) if payload is not None else getattr(client, method)(
+                        url, **headers
+                    )
+                    if response.streaming:
+                        body = b''.join(response.streaming_content)
+                    else:
+                        body = response.content
+                    elapsed = time.perf_counter() - started
+                result = results[name]
+                result['queries'].append(len(queries))
+                result['times'].append(elapsed)
+                result['bytes'].append(len(body))
+                result['status'].append(response.status_code)
+                if result['sql'] is None:
+                    result['sql'] = [
+                        query['sql'] for query in queries.captured_queries
+                    ]
+                if response.has_header('ETag'):
+                    state['etags'][name] = response['ETag']
+                if name == 'recipes-create' and response.status_code == 201:
+                    state['created'] = response.json()['id']
+                if name == 'token-login' and response.status_code == 200:
+                    state['session'] = response.json()['auth_token']
+        return [(case, results[case[0]]) for case in cases]
+
+    def report(self, results):
+        header = (
+            f'{"Сценарий":<32} {"статус":>6} {"SQL":>4} {"бюджет":>6} '
+            f'{"p50, мс":>8} {"p95, мс":>8} {"p99, мс":>8} {"байт":>8}'
+        )
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        failures = []
+        for (name, method, path, auth, expected, budget), result in results:
+            queries = max(result['queries'])
+            statuses = set(result['status'])
+            times = [value * 1000 for value in result['times']]
+            self.stdout.write(
+                f'{name:<32} {",".join(map(str, sorted(statuses))):>6} '
+                f'{queries:>4} {budget:>6} '
+                f'{percentile(times, 50):>8.2f} '
+                f'{percentile(times, 95):>8.2f} '
+                f'{percentile(times, 99):>8.2f} '
+                f'{max(result["bytes"]):>8}'
+            )
+            if queries > budget:
+                failures.append(
+                    f'{name}: {queries} SQL-запросов при бюджете {budget}'
+                )
+            if statuses != {expected}:
+                failures.append(
+                    f'{name}: статус {sorted(statuses)}, '
+                    f'ожидался {expected}'
+                )
+        if failures:
+            raise CommandError(
+                'Бенчмарк не пройден:\n' + '\n'.join(failures)
+            )
+        self.stdout.write(self.style.SUCCESS('Все бюджеты соблюдены.'))
@@ -0,0 +1,271 @@
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.management.base import CommandError
+from django.db import connection
+
+from .benchmark_api import Command as BenchmarkCommand
+from .benchmark_api import percentile
+
+HOST = '127.0.0.1'
+START_TIMEOUT = 30
+WARMUP = 2
+# Серверы: имя, WSGI/ASGI-приложение и аргументы gunicorn.
+SERVERS = {
+    'wsgi': ('foodgram.wsgi', ('--worker-class', 'gthread')),
+    'asgi': (
+        'foodgram.asgi:application',
+        ('--worker-class', 'uvicorn.workers.UvicornWorker')
+    ),
+}
+# Сценарии чтения: имя, путь, авторизация (как в benchmark_api).
+CASES = (
+    ('recipes-list-anonymous', '/api/recipes/', None),
+    ('recipes-list', '/api/recipes/', 'user'),
+    ('recipes-list-filtered', '/api/recipes/?tags=breakfast&tags=lunch',
+     'user'),
+    ('recipes-detail', '/api/recipes/{recipe}/', 'user'),
+    ('subscriptions', '/api/users/subscriptions/?recipes_limit=3', 'user'),
+    ('tags-list', '/api/tags/', None),
+    ('ingredients-search', '/api/ingredients/?name=мо', None),
+)
+
+
+def get_free_port():
+    with socket.socket() as sock:
+        sock.bind((HOST, 0))
+        return sock.getsockname()[1]
+
+
+async def fetch(reader, writer, request):
+    """Отправляет запрос по keep-alive соединению и читает ответ целиком."""
+    writer.write(request)
+    await writer.drain()
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError('Сервер закрыл соединение.')
+    length = 0
+    chunked = False
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.partition(b':')
+        name = name.strip().lower()
+        if name == b'content-length':
+            length = int(value)
+        elif name == b'transfer-encoding':
+            chunked = b'chunked' in value.lower()
+    if chunked:
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            await reader.readexactly(size + 2)
+            if not size:
+                break
+    elif length:
+        await reader.readexactly(length)
+    return int(status_line.split()[1])
+
+
+async def client(port, request, deadline, result):
+    """Один клиент: последовательные запросы до истечения времени."""
+    connection = None
+    while time.perf_counter() < deadline:
+        try:
+            if connection is None:
+                connection = await asyncio.open_connection(HOST, port)
+            started = time.perf_counter()
+            status = await fetch(*connection, request)
+            result['times'].append(time.perf_counter() - started)
+            if status >= 400:
+                result['errors'] += 1
+        except (OSError, ValueError, asyncio.IncompleteReadError):
+            result['errors'] += 1
+            if connection is not None:
+                connection[1].close()
+            connection = None
+    if connection is not None:
+        connection[1].close()
+
+
+async def load(port, request, concurrency, duration):
+    result = {'times': [], 'errors': 0}
+    deadline = time.perf_counter() + duration
+    await asyncio.gather(*(
+        client(port, request, deadline, result)
+        for _ in range(concurrency)
+    ))
+    return result
+
+
+class Command(BenchmarkCommand):
+    help = (
+        'Заполняет тестовую базу синтетическими данными, запускает API под '
+        'gunicorn (WSGI) и под uvicorn (ASGI) и сравнивает пропускную '
+        'способность и задержки эндпоинтов чтения при параллельной '
+        'нагрузке.'
+    )
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument(
+            '--servers', nargs='+', choices=SERVERS, default=list(SERVERS),
+            help='Какие серверы сравнивать.'
+        )
+        parser.add_argument(
+            '--workers', type=int, default=2,
+            help='Количество процессов сервера.'
+        )
+        parser.add_argument(
+            '--threads', type=int, default=8,
+            help=(
+                'Потоков на процесс: gthread у WSGI, пул запросов к БД '
+                '(ASYNC_DB_THREADS) у ASGI.'
+            )
+        )
+        parser.add_argument(
+            '--concurrency', type=int, default=64,
+            help='Количество одновременных клиентов.'
+        )
+        parser.add_argument(
+            '--duration', type=float, default=10,
+            help='Длительность нагрузки на один сценарий, секунд.'
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            return super().handle(*args, **options)
+        # Серверы работают в отдельных процессах, поэтому тестовая база
+        # SQLite создается в файле, а не в памяти.
+        with tempfile.TemporaryDirectory() as directory:
+            connection.settings_dict['TEST']['NAME'] = os.path.join(
+                directory, 'benchmark.sqlite3'
+            )
+            return super().handle(*args, **options)
+
+    def get_env(self, options):
+        env = dict(os.environ)
+        name = connection.settings_dict['NAME']
+        if connection.vendor == 'sqlite':
+            env['SQLITE_PATH'] = name
+        else:
+            env['POSTGRES_DB'] = name
+        env['ALLOWED_HOSTS'] = HOST
+        env.setdefault('CONN_MAX_AGE', '60')
+        env['ASYNC_DB_THREADS'] = str(options['threads'])
+        env['REQUEST_METRICS_LOG_LEVEL'] = 'WARNING'
+        env['DJANGO_SETTINGS_MODULE'] = os.environ.get(
+            'DJANGO_SETTINGS_MODULE', 'foodgram.settings'
+        )
+        return env
+
+    def start_server(self, name, port, options, log):
+        application, worker_args = SERVERS[name]
+        process = subprocess.Popen(
+            (
+                sys.executable, '-m', 'gunicorn', application,
+                '--bind', f'{HOST}:{port}',
+                '--workers', str(options['workers']),
+                '--threads', str(options['threads']),
+                *worker_args,
+            ),
+            cwd=settings.BASE_DIR, env=self.get_env(options),
+            stdout=log, stderr=log
+        )
+        deadline = time.monotonic() + START_TIMEOUT
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                log.seek(0)
+                raise CommandError(
+                    f'Сервер {name} не запустился:\n{log.read().decode()}'
+                )
+            try:
+                socket.create_connection((HOST, port), timeout=1).close()
+                return process
+            except OSError:
+                time.sleep(0.2)
+        process.kill()
+        raise CommandError(
+            f'Сервер {name} не запустился за {START_TIMEOUT} с.'
+        )
+
+    def stop_server(self, process):
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+    def build_request(self, path, auth, state, port):
+        headers = [
+            f'GET {quote(path.format(**state), safe="/?=&")} HTTP/1.1',
+            f'Host: {HOST}:{port}',
+            'Accept: application/json',
+        ]
+        if auth == 'user':
+            headers.append(f'Authorization: Token {state["token"]}')
+        return ('\r\n'.join(headers) + '\r\n\r\n').encode()
+
+    def run_cases(self, options):
+        state = self.prepare_state()
+        cases = [
+            case for case in CASES
+            if not options['only'] or case[0] in options['only']
+        ]
+        results = []
+        for server in options['servers']:
+            port = get_free_port()
+            with tempfile.TemporaryFile() as log:
+                process = self.start_server(server, port, options, log)
+                try:
+                    for name, path, auth in cases:
+                        request = self.build_request(path, auth, state, port)
+                        # Прогрев кэшей и соединений с БД в каждом процессе.
+                        asyncio.run(load(
+                            port, request, options['concurrency'], WARMUP
+                        ))
+                        result = asyncio.run(load(
+                            port, request, options['concurrency'],
+                            options['duration']
+                        ))
+                        result['rate'] = (
+                            len(result['times']) / options['duration']
+                        )
+                        results.append((name, server, result))
+                        self.stdout.write(
+                            f'{server}: {name} - {len(result["times"])} '
+                            f'запросов'
+                        )
+                finally:
+                    self.stop_server(process)
+        return results
+
+    def report(self, results):
+        header = (
+            f'{"Сценарий":<26} {"сервер":>6} {"запр/с":>8} {"p50, мс":>8} '
+            f'{"p99, мс":>8} {"ошибки":>7}'
+        )
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        order = {case[0]: index for index, case in enumerate(CASES)}
+        for name, server, result in sorted(
+            results, key=lambda row: (order[row[0]], row[1] != 'wsgi')
+        ):
+            times = [value * 1000 for value in result['times']] or [0]
+            self.stdout.write(
+                f'{name:<26} {server:>6} {result["rate"]:>8.0f} '
+                f'{percentile(times, 50):>8.2f} '
+                f'{percentile(times, 99):>8.2f} '
+                f'{result["errors"]:>7}'
+            )
+        if any(result['errors'] for _, _, result in results):
+            raise CommandError('Часть запросов завершилась с ошибкой.')
+        self.stdout.write(self.style.SUCCESS('Нагрузочный тест завершен.'))
@@ -0,0 +1,62 @@
+import os
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from foodgram_api.images import variant_name
+from recipes.models import Recipe
+
+IMAGE_DIRECTORY = 'recipes'
+
+
+class Command(BaseCommand):
+    help = (
+        'Удаляет картинки рецептов и их уменьшенные копии, на которые '
+        'не ссылается ни один рецепт.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--min-age', type=int, default=3600,
+            help='Не трогать файлы моложе стольких секунд: на них могут '
+                 'ссылаться еще не зафиксированные транзакции.'
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только показать файлы, которые будут удалены.'
+        )
+
+    def handle(self, *args, **options):
+        storage = Recipe._meta.get_field('image').storage
+        referenced = set()
+        for name in Recipe.objects.exclude(image='').values_list(
+            'image', flat=True
+        ).distinct().iterator():
+            referenced.add(name)
+            referenced.update(
+                variant_name(name, variant)
+                for variant in settings.RECIPE_IMAGE_VARIANTS
+            )
+        threshold = timezone.now() - timedelta(seconds=options['min_age'])
+        removed = 0
+        for directory in (
+            IMAGE_DIRECTORY, os.path.join(IMAGE_DIRECTORY, 'variants')
+        ):
+            if not storage.exists(directory):
+                continue
+            for filename in storage.listdir(directory)[1]:
+                name = os.path.join(directory, filename)
+                if (
+                    name in referenced
+                    or storage.get_modified_time(name) > threshold
+                ):
+                    continue
+                removed += 1
+                if options['dry_run']:
+                    self.stdout.write(name)
+                else:
+                    storage.delete(name)
+        action = 'К удалению' if options['dry_run'] else 'Удалено'
+        self.stdout.write(f'{action} файлов: {removed}.')
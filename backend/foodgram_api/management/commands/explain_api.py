@@ -0,0 +1,97 @@
+import json
+import re
+
+from django.core.management.base import CommandError
+from django.db import connection
+
+from .benchmark_api import Command as BenchmarkCommand
+
+EXPLAINED_STATEMENTS = ('SELECT', 'UPDATE', 'DELETE')
+# Маленькие справочники читаются целиком быстрее, чем по индексу.
+SMALL_TABLES = frozenset((
+    'recipes_tag', 'recipes_resourceversion', 'django_content_type',
+))
+SQLITE_FULL_SCAN = re.compile(r'^SCAN (?:TABLE )?(\w+)$')
+
+
+def postgres_seq_scans(plan):
+    if plan.get('Node Type') == 'Seq Scan':
+        yield plan['Relation Name']
+    for child in plan.get('Plans', ()):
+        yield from postgres_seq_scans(child)
+
+
+def sequential_scans(sql):
+    """Таблицы, которые запрос читает полным перебором."""
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}')
+            plan = cursor.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            return set(postgres_seq_scans(plan[0]['Plan']))
+        if connection.vendor == 'sqlite':
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            details = [detail for *_, detail in cursor.fetchall()]
+            # Обход по первичному ключу с LIMIT без сортировки во временном
+            # дереве останавливается на первых строках, а не читает всё.
+            if ' LIMIT ' in sql and not any(
+                'TEMP B-TREE' in detail for detail in details
+            ):
+                return set()
+            return {
+                match.group(1)
+                for match in map(SQLITE_FULL_SCAN.match, details)
+                if match
+            }
+    raise CommandError(
+        f'EXPLAIN для {connection.vendor} не поддерживается.'
+    )
+
+
+class Command(BenchmarkCommand):
+    help = (
+        'Заполняет тестовую базу синтетическими данными, выполняет '
+        'сценарии бенчмарка и показывает запросы, которые читают таблицы '
+        'полным перебором вместо индекса.'
+    )
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument(
+            '--strict', action='store_true',
+            help='Завершиться с ошибкой, если найдены полные переборы.'
+        )
+        parser.set_defaults(iterations=1)
+
+    def handle(self, *args, **options):
+        self.strict = options['strict']
+        super().handle(*args, **options)
+
+    def run_cases(self, options):
+        results = super().run_cases(options)
+        self.scans = []
+        # Подзапросы и CTE в плане тоже выглядят как SCAN, их пропускаем.
+        known = set(connection.introspection.table_names())
+        for (name, *_), result in results:
+            for sql in result['sql'] or ():
+                if not sql.lstrip().upper().startswith(EXPLAINED_STATEMENTS):
+                    continue
+                tables = (sequential_scans(sql) & known) - SMALL_TABLES
+                if tables:
+                    self.scans.append((name, sorted(tables), sql))
+        return results
+
+    def report(self, results):
+        for name, tables, sql in self.scans:
+            self.stdout.write(
+                f'{name}: полный перебор {", ".join(tables)}\n    {sql}'
+            )
+        if self.scans and self.strict:
+            raise CommandError(
+                f'Найдено запросов с полным перебором: {len(self.scans)}.'
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f'Проверено сценариев: {len(results)}, запросов с полным '
+            f'перебором: {len(self.scans)}.'
+        ))
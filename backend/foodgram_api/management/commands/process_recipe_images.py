@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from foodgram_api.images import generate_variants
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = (
+        'Создает уменьшенные копии картинок рецептов, которые еще '
+        'не прошли фоновую обработку.'
+    )
+
+    def handle(self, *args, **options):
+        names = Recipe.objects.filter(
+            has_image_variants=False
+        ).exclude(image='').values_list('image', flat=True).distinct()
+        processed = failed = 0
+        for name in names.iterator():
+            try:
+                generate_variants(name)
+            except (OSError, ValueError) as error:
+                failed += 1
+                self.stderr.write(f'{name}: {error}')
+                continue
+            processed += 1
+        self.stdout.write(
+            f'Обработано картинок: {processed}, с ошибками: {failed}.'
+        )
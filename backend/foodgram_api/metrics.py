@@ -0,0 +1,272 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+logger = logging.getLogger(__name__)
+
+DURATION_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10
+)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+HISTOGRAMS = (
+    ('request_duration_seconds', 'Время обработки запроса.',
+     DURATION_BUCKETS),
+    ('request_db_seconds', 'Время SQL-запросов за запрос.', DURATION_BUCKETS),
+    ('request_serializer_seconds', 'Время сериализации ответа.',
+     DURATION_BUCKETS),
+    ('request_queries', 'Количество SQL-запросов за запрос.', QUERY_BUCKETS),
+    ('response_size_bytes', 'Размер ответа.', SIZE_BUCKETS),
+)
+PREFIX = 'foodgram_'
+
+current_metrics = ContextVar('request_metrics', default=None)
+
+
+class RequestMetrics:
+    """Счетчики одного запроса: SQL, сериализация и размер ответа."""
+
+    __slots__ = (
+        'started', 'view', 'queries', 'db_time', 'serializer_time',
+        'serializer_depth', 'size'
+    )
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.view = 'unresolved'
+        self.queries = 0
+        self.db_time = 0.0
+        self.serializer_time = 0.0
+        self.serializer_depth = 0
+        self.size = 0
+
+    def server_timing(self, total):
+        return (
+            f'db;dur={self.db_time * 1000:.1f};desc="{self.queries} queries", '
+            f'serializer;dur={self.serializer_time * 1000:.1f}, '
+            f'total;dur={total * 1000:.1f}'
+        )
+
+
+class Histogram:
+    """Гистограмма в формате Prometheus с разбивкой по имени вьюхи."""
+
+    def __init__(self, name, help_text, buckets):
+        self.name = PREFIX + name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.series = {}
+
+    def observe(self, label, value):
+        series = self.series.get(label)
+        if series is None:
+            series = self.series[label] = [
+                [0] * (len(self.buckets) + 1), 0.0
+            ]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def render(self):
+        yield f'# HELP {self.name} {self.help_text}'
+        yield f'# TYPE {self.name} histogram'
+        for label, (counts, total) in sorted(self.series.items()):
+            view = label.replace('\\', '\\\\').replace('"', '\\"')
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                yield (
+                    f'{self.name}_bucket{{view="{view}",le="{bound}"}} '
+                    f'{cumulative}'
+                )
+            cumulative += counts[-1]
+            yield f'{self.name}_bucket{{view="{view}",le="+Inf"}} {cumulative}'
+            yield f'{self.name}_sum{{view="{view}"}} {total}'
+            yield f'{self.name}_count{{view="{view}"}} {cumulative}'
+
+
+class MetricsRegistry:
+    """Гистограммы запросов процесса, накопленные с момента запуска."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.histograms = {
+            name: Histogram(name, help_text, buckets)
+            for name, help_text, buckets in HISTOGRAMS
+        }
+
+    def record(self, metrics, total):
+        values = {
+            'request_duration_seconds': total,
+            'request_db_seconds': metrics.db_time,
+            'request_serializer_seconds': metrics.serializer_time,
+            'request_queries': metrics.queries,
+            'response_size_bytes': metrics.size,
+        }
+        with self._lock:
+            for name, value in values.items():
+                self.histograms[name].observe(metrics.view, value)
+
+    def render(self):
+        with self._lock:
+            lines = [
+                line
+                for histogram in self.histograms.values()
+                for line in histogram.render()
+            ]
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+
+def record_query(execute, sql, params, many, context):
+    """Обертка выполнения SQL: засчитывает запрос в метрики запроса.
+
+    Метрики берутся из контекстной переменной, поэтому учитываются и
+    запросы из потоков, в которые асинхронные вьюхи выносят работу с БД.
+    """
+    metrics = current_metrics.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.db_time += time.perf_counter() - started
+        metrics.queries += 1
+
+
+def install_query_wrapper(connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class MeasuredSerializerMixin:
+    """Засчитывает в метрики запроса время to_representation.
+
+    Подключается к сериализаторам ответов API, поэтому в замер попадают и
+    ленивые запросы к БД при сериализации. Вложенные сериализаторы и
+    элементы списка внутри замера повторно не засчитываются.
+    """
+
+    def to_representation(self, instance):
+        metrics = current_metrics.get()
+        if metrics is None or metrics.serializer_depth:
+            return super().to_representation(instance)
+        metrics.serializer_depth += 1
+        started = time.perf_counter()
+        try:
+            return super().to_representation(instance)
+        finally:
+            metrics.serializer_time += time.perf_counter() - started
+            metrics.serializer_depth -= 1
+
+
+def get_view_name(view_func, request):
+    """Имя вьюхи для меток: Класс.действие или имя функции."""
+    cls = getattr(view_func, 'cls', None)
+    actions = getattr(view_func, 'actions', None)
+    if cls is not None and actions:
+        action = actions.get(request.method.lower(), request.method.lower())
+        return f'{cls.__name__}.{action}'
+    if cls is not None:
+        return cls.__name__
+    return getattr(view_func, '__qualname__', type(view_func).__name__)
+
+
+class RequestMetricsMiddleware:
+    """Замеряет SQL, сериализацию и размер ответа каждого запроса.
+
+    Итоги уходят в заголовок Server-Timing, в лог одной JSON-строкой и в
+    гистограммы процесса, которые отдает эндпоинт /api/metrics/. При
+    REQUEST_METRICS_ENABLED = False Django не подключает middleware.
+    Работает и в синхронной, и в асинхронной цепочке обработчиков.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.REQUEST_METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # Тот же признак ставит MiddlewareMixin Django.
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+        connection_created.connect(install_query_wrapper)
+        for connection in connections.all():
+            install_query_wrapper(connection)
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self):
+            return self.__acall__(request)
+        metrics = RequestMetrics()
+        token = current_metrics.set(metrics)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_metrics.reset(token)
+        return self.complete(request, response, metrics)
+
+    async def __acall__(self, request):
+        metrics = RequestMetrics()
+        token = current_metrics.set(metrics)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_metrics.reset(token)
+        return self.complete(request, response, metrics)
+
+    def complete(self, request, response, metrics):
+        resolver_match = getattr(request, 'resolver_match', None)
+        if resolver_match is not None:
+            metrics.view = get_view_name(resolver_match.func, request)
+        if response.streaming:
+            response['Server-Timing'] = metrics.server_timing(
+                time.perf_counter() - metrics.started
+            )
+            response.streaming_content = self.stream(
+                request, response, response.streaming_content, metrics
+            )
+            return response
+        metrics.size = len(response.content)
+        total = time.perf_counter() - metrics.started
+        response['Server-Timing'] = metrics.server_timing(total)
+        self.finish(request, response, metrics, total)
+        return response
+
+    def stream(self, request, response, content, metrics):
+        """Досчитывает потоковый ответ: SQL и размер по мере отдачи."""
+        token = current_metrics.set(metrics)
+        try:
+            for chunk in content:
+                metrics.size += len(chunk)
+                yield chunk
+        finally:
+            current_metrics.reset(token)
+        self.finish(
+            request, response, metrics, time.perf_counter() - metrics.started
+        )
+
+    def finish(self, request, response, metrics, total):
+        registry.record(metrics, total)
+        logger.info(json.dumps({
+            'method': request.method,
+            'path': request.path,
+            'view': metrics.view,
+            'status': response.status_code,
+            'duration_ms': round(total * 1000, 1),
+            'queries': metrics.queries,
+            'db_ms': round(metrics.db_time * 1000, 1),
+            'serializer_ms': round(metrics.serializer_time * 1000, 1),
+            'size': metrics.size,
+        }))
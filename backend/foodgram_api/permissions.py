@@ -1,3 +1,5 @@
+from django.conf import settings
+from django.utils.crypto import constant_time_compare
 from rest_framework import permissions
 
 
@@ -7,5 +9,15 @@ class IsAuthorOrReadOnly(permissions.BasePermission):
             request.method in permissions.SAFE_METHODS
             or request.user.is_authenticated
             and request.user.is_active
-            and request.user == obj.author
+            and request.user.pk == obj.author_id
+        )
+
+
+class HasMetricsToken(permissions.BasePermission):
+    """Доступ по заголовку Authorization: Bearer <METRICS_TOKEN>."""
+
+    def has_permission(self, request, view):
+        return bool(settings.METRICS_TOKEN) and constant_time_compare(
+            request.headers.get('Authorization', ''),
+            f'Bearer {settings.METRICS_TOKEN}'
         )
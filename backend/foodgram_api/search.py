@@ -0,0 +1,215 @@
+import heapq
+import threading
+import time
+from array import array
+from bisect import bisect_left, insort
+
+from django.conf import settings
+
+from recipes.models import Ingredient, IngredientsInRecipe
+
+
+class IngredientIndex:
+    """Индекс ингредиентов в памяти процесса для автодополнения.
+
+    Названия хранятся приведенными к нижнему регистру и отсортированными,
+    поэтому совпадения по префиксу находятся бинарным поиском. Совпадения
+    по подстроке идут в выдаче после совпадений по префиксу. Индекс
+    строится при первом запросе, сбрасывается сигналами при изменении
+    ингредиентов и перестраивается не реже раза в INGREDIENT_INDEX_TTL
+    секунд, чтобы подхватывать изменения из других процессов.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshot = None
+
+    def invalidate(self):
+        self._snapshot = None
+
+    def build(self):
+        rows = sorted(
+            (name.casefold(), pk, name, measurement_unit)
+            for pk, name, measurement_unit in Ingredient.objects.values_list(
+                'id', 'name', 'measurement_unit'
+            )
+        )
+        keys = [row[0] for row in rows]
+        items = [
+            {'id': pk, 'name': name, 'measurement_unit': measurement_unit}
+            for _, pk, name, measurement_unit in rows
+        ]
+        return time.monotonic(), keys, items
+
+    def get_snapshot(self):
+        snapshot = self._snapshot
+        if (
+            snapshot is None
+            or time.monotonic() - snapshot[0] > settings.INGREDIENT_INDEX_TTL
+        ):
+            with self._lock:
+                if self._snapshot is snapshot:
+                    self._snapshot = self.build()
+                snapshot = self._snapshot
+        return snapshot
+
+    def search(self, query, limit=None):
+        """Ингредиенты, название которых начинается с query или содержит его.
+
+        Возвращает не более limit словарей с полями IngredientSerializer.
+        """
+        limit = limit or settings.INGREDIENT_SEARCH_LIMIT
+        query = query.strip().casefold()
+        _, keys, items = self.get_snapshot()
+        found = []
+        for index in range(bisect_left(keys, query), len(keys)):
+            if len(found) >= limit or not keys[index].startswith(query):
+                break
+            found.append(index)
+        if len(found) < limit:
+            for index, key in enumerate(keys):
+                if query in key and not key.startswith(query):
+                    found.append(index)
+                    if len(found) >= limit:
+                        break
+        return [items[index] for index in found]
+
+
+ingredient_index = IngredientIndex()
+
+
+class RecipeIngredientIndex:
+    """Обратный индекс ингредиент -> рецепты для подбора по продуктам.
+
+    Для каждого ингредиента хранится отсортированный массив id рецептов,
+    для каждого рецепта - массив id его ингредиентов. После изменения
+    рецепта сигналы обновляют только его записи. Словари и массивы
+    снимка не изменяются на месте: запись строит их копии и подменяет
+    снимок целиком, поэтому чтение идет без блокировки.
+    Как и IngredientIndex, индекс перестраивается целиком не реже раза
+    в RECIPE_INGREDIENT_INDEX_TTL секунд.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshot = None
+
+    def invalidate(self):
+        self._snapshot = None
+
+    def build(self):
+        postings, recipes = {}, {}
+        rows = IngredientsInRecipe.objects.values_list(
+            'recipe_id', 'ingredient_id'
+        ).order_by('recipe_id', 'ingredient_id').distinct()
+        for recipe_id, ingredient_id in rows.iterator():
+            postings.setdefault(ingredient_id, array('l')).append(recipe_id)
+            recipes.setdefault(recipe_id, array('l')).append(ingredient_id)
+        return time.monotonic(), postings, recipes
+
+    def get_snapshot(self):
+        snapshot = self._snapshot
+        if (
+            snapshot is None
+            or time.monotonic() - snapshot[0]
+            > settings.RECIPE_INGREDIENT_INDEX_TTL
+        ):
+            with self._lock:
+                if self._snapshot is snapshot:
+                    self._snapshot = self.build()
+                snapshot = self._snapshot
+        return snapshot
+
+    def refresh(self, recipe_ids):
+        """Перечитывает ингредиенты рецептов после их изменения."""
+        if self._snapshot is None:
+            return
+        current = {recipe_id: set() for recipe_id in recipe_ids}
+        for recipe_id, ingredient_id in IngredientsInRecipe.objects.filter(
+            recipe_id__in=recipe_ids
+        ).values_list('recipe_id', 'ingredient_id'):
+            current[recipe_id].add(ingredient_id)
+        self.update(current)
+
+    def remove_recipes(self, recipe_ids):
+        """Убирает удаленные рецепты без обращения к базе."""
+        self.update({recipe_id: set() for recipe_id in recipe_ids})
+
+    def update(self, current):
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot is None:
+                return
+            built_at, postings, recipes = snapshot
+            postings, recipes = dict(postings), dict(recipes)
+            for recipe_id, ingredient_ids in current.items():
+                old = set(recipes.get(recipe_id, ()))
+                for ingredient_id in old - ingredient_ids:
+                    postings[ingredient_id] = array('l', (
+                        item for item in postings[ingredient_id]
+                        if item != recipe_id
+                    ))
+                for ingredient_id in ingredient_ids - old:
+                    posting = array('l', postings.get(ingredient_id, ()))
+                    insort(posting, recipe_id)
+                    postings[ingredient_id] = posting
+                if ingredient_ids:
+                    recipes[recipe_id] = array('l', sorted(ingredient_ids))
+                else:
+                    recipes.pop(recipe_id, None)
+            self._snapshot = built_at, postings, recipes
+
+    def remove_ingredient(self, ingredient_id):
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot is None or ingredient_id not in snapshot[1]:
+                return
+            built_at, postings, recipes = snapshot
+            postings, recipes = dict(postings), dict(recipes)
+            for recipe_id in postings.pop(ingredient_id):
+                recipes[recipe_id] = array('l', (
+                    item for item in recipes.get(recipe_id, ())
+                    if item != ingredient_id
+                ))
+            self._snapshot = built_at, postings, recipes
+
+    def match(self, ingredient_ids):
+        """Рецепты, в которых есть хотя бы один из ingredient_ids.
+
+        Возвращает RecipeMatches: пары (id рецепта, доля имеющихся
+        ингредиентов) по убыванию доли, затем числа совпадений и id.
+        """
+        _, postings, recipes = self.get_snapshot()
+        matched = {}
+        for ingredient_id in set(ingredient_ids):
+            for recipe_id in postings.get(ingredient_id, ()):
+                matched[recipe_id] = matched.get(recipe_id, 0) + 1
+        keys = []
+        for recipe_id, count in matched.items():
+            ingredients = recipes.get(recipe_id)
+            if ingredients:
+                keys.append((count / len(ingredients), count, recipe_id))
+        return RecipeMatches(keys)
+
+
+class RecipeMatches:
+    """Совпадения по ингредиентам для пагинатора.
+
+    Пагинатору нужны только длина и срез, поэтому весь список не
+    сортируется: для среза [start:stop] heapq.nlargest выбирает stop
+    лучших рецептов.
+    """
+
+    def __init__(self, keys):
+        self.keys = keys
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __getitem__(self, index):
+        start, stop, step = index.indices(len(self.keys))
+        ranked = heapq.nlargest(stop, self.keys)[start:stop:step]
+        return [(recipe_id, coverage) for coverage, _, recipe_id in ranked]
+
+
+recipe_ingredient_index = RecipeIngredientIndex()
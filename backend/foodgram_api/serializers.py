@@ -1,15 +1,21 @@
-from django.shortcuts import get_object_or_404
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
 from djoser.serializers import UserSerializer
-from rest_framework import serializers, status, validators
+from rest_framework import serializers, status
 
 from recipes.models import (Favourites, Ingredient, IngredientsInRecipe,
-                            Recipe, ShoppingCart, Tag)
+                            Recipe, ShoppingCart, ShoppingListItem, Tag,
+                            TimelineEntry)
 from users.models import Follow, User
 
-from .utils import Base64ImageField, ingredient_valid, tag_valid
+from .metrics import MeasuredSerializerMixin
+from .utils import (Base64ImageField, RecipeImageField, already_exists,
+                    get_recipes_limit, ingredient_valid, insert_ignore,
+                    tag_valid)
 
 
-class CastomUserSerializer(UserSerializer):
+class CastomUserSerializer(MeasuredSerializerMixin, UserSerializer):
     """Сериализатор для получения информации о пользователях."""
 
     is_subscribed = serializers.SerializerMethodField()
@@ -22,15 +28,22 @@ class CastomUserSerializer(UserSerializer):
         )
 
     def get_is_subscribed(self, obj):
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         user = self.context.get('request').user
-        if user.is_anonymous:
+        # Подписаться на себя не дает ограничение модели Follow.
+        if user.is_anonymous or user.pk == obj.pk:
             return False
         return Follow.objects.filter(user=user, author=obj).exists()
 
 
-class RecipesForSubscriptionsSerializer(serializers.ModelSerializer):
+class RecipesForSubscriptionsSerializer(
+    MeasuredSerializerMixin, serializers.ModelSerializer
+):
     """Сериализатор рецептов для модели подписок."""
 
+    image = RecipeImageField('thumbnail')
+
     class Meta:
         model = Recipe
         fields = ('id', 'name', 'image', 'cooking_time')
@@ -40,7 +53,7 @@ class FollowSerializer(CastomUserSerializer):
     """Сериализатор для работы с подписками."""
 
     recipes = serializers.SerializerMethodField()
-    recipes_count = serializers.SerializerMethodField()
+    recipes_count = serializers.IntegerField(read_only=True)
 
     class Meta(CastomUserSerializer.Meta):
         model = User
@@ -49,37 +62,31 @@ class FollowSerializer(CastomUserSerializer):
         )
         read_only_fields = ('email', 'username', 'first_name', 'last_name')
 
-    def get_recipes_count(self, obj):
-        return Recipe.objects.filter(author=obj).count()
-
     def get_recipes(self, obj):
-        recipes_limit = self.context.get(
-            'request').query_params.get('recipes_limit')
-        if recipes_limit:
-            queryset = Recipe.objects.filter(
-                author=obj.id)[:int(recipes_limit)]
+        recipes = self.context.get('recipes')
+        if recipes is not None:
+            queryset = recipes.get(obj.id, ())
         else:
-            queryset = Recipe.objects.filter(author=obj.id).all()
+            queryset = Recipe.objects.filter(author=obj.id)[
+                :get_recipes_limit(self.context.get('request'))
+            ]
         serializer = RecipesForSubscriptionsSerializer(
             instance=queryset, many=True
         )
         return serializer.data
 
     def validate(self, data):
-        author = self.instance
-        user = self.context.get('request').user
-        if Follow.objects.filter(user=user, author=author).exists():
-            raise serializers.ValidationError(
-                'Вы уже подписаны на этого пользователя!'
-            )
-        if user == author:
+        """Повторную подписку отсекает insert_ignore при создании."""
+        if self.context.get('request').user == self.instance:
             raise serializers.ValidationError(
                 'Вы не можете подписаться на самого себя!'
             )
         return data
 
 
-class IngredientSerializer(serializers.ModelSerializer):
+class IngredientSerializer(
+    MeasuredSerializerMixin, serializers.ModelSerializer
+):
     """Сериализатор для работы с ингредиентами."""
 
     class Meta:
@@ -87,7 +94,9 @@ class IngredientSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'measurement_unit')
 
 
-class TagSerializer(serializers.ModelSerializer):
+class TagSerializer(
+    MeasuredSerializerMixin, serializers.ModelSerializer
+):
     """Сериализатор для работы с тегами."""
 
     class Meta:
@@ -121,7 +130,9 @@ class IngredientGetSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'measurement_unit', 'amount')
 
 
-class RecipeReadSerializer(serializers.ModelSerializer):
+class RecipeReadSerializer(
+    MeasuredSerializerMixin, serializers.ModelSerializer
+):
     """Сериализатор для получения рецепта или списка рецептов."""
 
     tags = TagSerializer(many=True, read_only=True)
@@ -129,9 +140,9 @@ class RecipeReadSerializer(serializers.ModelSerializer):
     ingredients = IngredientGetSerializer(
         many=True, source='recipe'
     )
-    image = Base64ImageField(required=False)
-    is_favorited = serializers.SerializerMethodField()
-    is_in_shopping_cart = serializers.SerializerMethodField()
+    image = RecipeImageField('medium')
+    is_favorited = serializers.BooleanField(read_only=True)
+    is_in_shopping_cart = serializers.BooleanField(read_only=True)
 
     class Meta:
         model = Recipe
@@ -140,25 +151,38 @@ class RecipeReadSerializer(serializers.ModelSerializer):
             'is_in_shopping_cart', 'name', 'image', 'text', 'cooking_time'
         )
 
-    def get_is_favorited(self, obj):
-        user = self.context.get('request').user
-        if user.is_anonymous:
-            return False
-        return Favourites.objects.filter(user=user, recipe=obj).exists()
 
-    def get_is_in_shopping_cart(self, obj):
-        user = self.context.get('request').user
-        if user.is_anonymous:
-            return False
-        return ShoppingCart.objects.filter(user=user, recipe=obj).exists()
+class RecipeMatchSerializer(RecipeReadSerializer):
+    """Рецепт, подобранный по имеющимся ингредиентам."""
 
+    coverage = serializers.FloatField(read_only=True)
+    missing_ingredients = serializers.SerializerMethodField()
 
-class RecipeCreateSerializer(serializers.ModelSerializer):
+    class Meta(RecipeReadSerializer.Meta):
+        fields = RecipeReadSerializer.Meta.fields + (
+            'coverage', 'missing_ingredients'
+        )
+
+    def get_missing_ingredients(self, obj):
+        available = self.context['available']
+        return [
+            {
+                'id': row.ingredient_id,
+                'name': row.ingredient.name,
+                'measurement_unit': row.ingredient.measurement_unit,
+                'amount': row.amount
+            }
+            for row in obj.recipe.all()
+            if row.ingredient_id not in available
+        ]
+
+
+class RecipeCreateSerializer(
+    MeasuredSerializerMixin, serializers.ModelSerializer
+):
     """Сериализатор для создания или изменения рецепта."""
 
-    tags = serializers.PrimaryKeyRelatedField(
-        queryset=Tag.objects.all(), many=True
-    )
+    tags = serializers.ListField(child=serializers.IntegerField())
     ingredients = IngredientsInRecipeSerializer(
         many=True, source='recipe'
     )
@@ -172,30 +196,32 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
         )
 
     def validate(self, data):
-        ingredient_valid(serializers, data, Ingredient)
-        tag_valid(serializers, data, Tag)
-        if int(data.get('cooking_time')) < 1:
+        """Ингредиенты и теги проверяются одним запросом на каждую таблицу.
+
+        Найденные ингредиенты сохраняются, чтобы не читать их повторно
+        при создании строк рецепта.
+        """
+        self.ingredients_map = ingredient_valid(
+            serializers, data, Ingredient
+        )
+        data['tags'] = tag_valid(serializers, data, Tag)
+        if 'cooking_time' in data and int(data['cooking_time']) < 1:
             raise serializers.ValidationError(
                 'Время приготовления не может быть меньше одной минуты!'
             )
         return data
 
     def create_ingredients(self, ingredients, recipe):
-        ingredient_list = []
-        for ingredient in ingredients:
-            current_ingredient = get_object_or_404(
-                Ingredient, id=ingredient.get('id')
-            )
-            amount = ingredient.get('amount')
-            ingredient_list.append(
-                IngredientsInRecipe(
-                    recipe=recipe,
-                    ingredient=current_ingredient,
-                    amount=amount
-                )
+        IngredientsInRecipe.objects.bulk_create(
+            IngredientsInRecipe(
+                recipe=recipe,
+                ingredient=self.ingredients_map[ingredient.get('id')],
+                amount=ingredient.get('amount')
             )
-        IngredientsInRecipe.objects.bulk_create(ingredient_list)
+            for ingredient in ingredients
+        )
 
+    @transaction.atomic
     def create(self, validated_data):
         user = self.context.get('request').user
         if user.is_anonymous:
@@ -209,20 +235,92 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
         recipe = Recipe.objects.create(author=user, **validated_data)
         recipe.tags.set(tags)
         self.create_ingredients(ingredients, recipe)
+        TimelineEntry.objects.fan_out(recipe)
         return recipe
 
+    def update_ingredients(self, ingredients, recipe):
+        """Применяет к строкам рецепта только разницу с текущим составом.
+
+        Возвращает признак изменения и разницу количества по ингредиентам
+        для списков покупок.
+        """
+        new_amounts = {
+            ingredient.get('id'): ingredient.get('amount')
+            for ingredient in ingredients
+        }
+        deltas = dict(new_amounts)
+        current, to_update, to_delete = set(), [], []
+        for row in IngredientsInRecipe.objects.filter(recipe=recipe):
+            deltas[row.ingredient_id] = (
+                deltas.get(row.ingredient_id, 0) - row.amount
+            )
+            amount = new_amounts.get(row.ingredient_id)
+            if amount is None or row.ingredient_id in current:
+                to_delete.append(row.pk)
+                continue
+            current.add(row.ingredient_id)
+            if row.amount != amount:
+                row.amount = amount
+                to_update.append(row)
+        to_create = [
+            ingredient for ingredient in ingredients
+            if ingredient.get('id') not in current
+        ]
+        IngredientsInRecipe.objects.filter(pk__in=to_delete).delete()
+        IngredientsInRecipe.objects.bulk_update(to_update, ('amount',))
+        self.create_ingredients(to_create, recipe)
+        return bool(to_delete or to_update or to_create), deltas
+
+    def image_changed(self, instance, image):
+        """Повторно загруженная та же картинка не считается изменением."""
+        field = instance.image.field
+        return field.storage.content_name(
+            field.generate_filename(instance, image.name), image
+        ) != instance.image.name
+
+    @transaction.atomic
     def update(self, instance, validated_data):
+        """Обновляет рецепт, затрагивая только изменившиеся строки."""
         ingredients = validated_data.pop('recipe')
         tags = validated_data.pop('tags')
-        instance.tags.clear()
-        instance.tags.set(tags)
-        instance.ingredients.clear()
-        self.create_ingredients(ingredients, instance)
-        instance.save()
+        update_fields = [
+            field for field, value in validated_data.items()
+            if (
+                self.image_changed(instance, value) if field == 'image'
+                else getattr(instance, field) != value
+            )
+        ]
+        for field in update_fields:
+            setattr(instance, field, validated_data[field])
+        if 'image' in update_fields:
+            instance.has_image_variants = False
+            update_fields.append('has_image_variants')
+        changed = bool(update_fields)
+        current = set(instance.tags.values_list('id', flat=True))
+        new = {tag.id for tag in tags}
+        if current != new:
+            instance.tags.remove(*(current - new))
+            instance.tags.add(*(new - current))
+            changed = True
+        ingredients_changed, deltas = self.update_ingredients(
+            ingredients, instance
+        )
+        changed = changed or ingredients_changed
+        ShoppingListItem.objects.apply_deltas(
+            ShoppingCart.objects.filter(recipe=instance).values_list(
+                'user_id', flat=True
+            ),
+            deltas
+        )
+        if changed:
+            instance.save(update_fields=(*update_fields, 'version'))
         return instance
 
     def to_representation(self, instance):
         request = self.context.get('request')
+        instance = Recipe.objects.with_user_flags(request.user).get(
+            pk=instance.pk
+        )
         return RecipeReadSerializer(
             instance,
             context={'request': request}
@@ -235,13 +333,17 @@ class FavouritesSerializer(serializers.ModelSerializer):
     class Meta:
         model = Favourites
         fields = ('user', 'recipe')
-        validators = [
-            validators.UniqueTogetherValidator(
-                queryset=Favourites.objects.all(),
-                fields=('user', 'recipe'),
-                message='Рецепт уже добавлен в избранное!'
-            )
-        ]
+        read_only_fields = ('user', 'recipe')
+
+    @transaction.atomic
+    def create(self, validated_data):
+        instance = Favourites(**validated_data)
+        if not insert_ignore(instance):
+            raise already_exists('Рецепт уже добавлен в избранное!')
+        Recipe.objects.filter(pk=instance.recipe_id).update(
+            favourites_count=F('favourites_count') + 1
+        )
+        return instance
 
     def to_representation(self, instance):
         request = self.context.get('request')
@@ -257,13 +359,17 @@ class ShoppingCartSerializer(serializers.ModelSerializer):
     class Meta:
         model = ShoppingCart
         fields = ('user', 'recipe')
-        validators = [
-            validators.UniqueTogetherValidator(
-                queryset=ShoppingCart.objects.all(),
-                fields=('user', 'recipe'),
-                message='Рецепт уже добавлен в список покупок!'
-            )
-        ]
+        read_only_fields = ('user', 'recipe')
+
+    @transaction.atomic
+    def create(self, validated_data):
+        instance = ShoppingCart(**validated_data)
+        if not insert_ignore(instance):
+            raise already_exists('Рецепт уже добавлен в список покупок!')
+        ShoppingListItem.objects.add_recipe(
+            (instance.user_id,), instance.recipe
+        )
+        return instance
 
     def to_representation(self, instance):
         request = self.context.get('request')
@@ -271,3 +377,18 @@ class ShoppingCartSerializer(serializers.ModelSerializer):
             instance.recipe,
             context={'request': request}
         ).data
+
+
+class BatchSerializer(serializers.Serializer):
+    """Список id для пакетных операций."""
+
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1), allow_empty=False
+    )
+
+    def validate_ids(self, value):
+        if len(value) > settings.BATCH_MAX_SIZE:
+            raise serializers.ValidationError(
+                f'Не больше {settings.BATCH_MAX_SIZE} id за один запрос!'
+            )
+        return list(dict.fromkeys(value))
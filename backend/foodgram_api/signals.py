@@ -0,0 +1,224 @@
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.db.models.signals import (m2m_changed, post_delete, post_init,
+                                      post_save, pre_delete, pre_save)
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from recipes.models import (Favourites, Ingredient, IngredientsInRecipe,
+                            Recipe, ResourceVersion, ShoppingCart,
+                            ShoppingListItem, Tag)
+from users.models import Follow, User
+
+from .authentication import token_cache
+from .caching import recipe_feed_cache
+from .images import image_pipeline
+from .search import ingredient_index, recipe_ingredient_index
+
+FEED_AUTHOR_FIELDS = {'email', 'username', 'first_name', 'last_name'}
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+def invalidate_ingredient_index(**kwargs):
+    ingredient_index.invalidate()
+
+
+@receiver(post_delete, sender=Ingredient)
+def remove_ingredient_from_recipe_index(instance, **kwargs):
+    recipe_ingredient_index.remove_ingredient(instance.pk)
+
+
+@receiver(post_save, sender=Recipe)
+def refresh_recipe_ingredient_index(instance, **kwargs):
+    """Ингредиенты рецепта перечитываются после фиксации транзакции."""
+    recipe_id = instance.pk
+    transaction.on_commit(
+        lambda: recipe_ingredient_index.refresh((recipe_id,))
+    )
+
+
+@receiver(post_delete, sender=Recipe)
+def remove_recipe_from_ingredient_index(instance, **kwargs):
+    recipe_id = instance.pk
+    transaction.on_commit(
+        lambda: recipe_ingredient_index.remove_recipes((recipe_id,))
+    )
+
+
+@receiver(pre_delete, sender=Recipe)
+def collect_shopping_list_users(instance, **kwargs):
+    """Запоминает, в чьих корзинах лежит удаляемый рецепт."""
+    instance._shopping_list_users = list(
+        ShoppingCart.objects.filter(recipe=instance).values_list(
+            'user_id', flat=True
+        )
+    )
+
+
+@receiver(post_delete, sender=Recipe)
+def rebuild_shopping_lists(instance, **kwargs):
+    """Корзины удаляются каскадом, списки покупок пересчитываются.
+
+    Так списки остаются верными при удалении рецепта через API, админку
+    и вместе с автором.
+    """
+    ShoppingListItem.objects.rebuild(
+        getattr(instance, '_shopping_list_users', ())
+    )
+
+
+@receiver(post_save, sender=Recipe)
+def increment_recipes_count(instance, created, **kwargs):
+    if created:
+        User.objects.filter(pk=instance.author_id).update(
+            recipes_count=F('recipes_count') + 1
+        )
+
+
+@receiver(post_delete, sender=Recipe)
+def decrement_recipes_count(instance, **kwargs):
+    User.objects.filter(pk=instance.author_id).update(
+        recipes_count=Greatest(F('recipes_count') - 1, 0)
+    )
+
+
+@receiver(pre_delete, sender=User)
+def collect_user_counters(instance, **kwargs):
+    """Запоминает рецепты в избранном и авторов в подписках пользователя."""
+    instance._favourite_recipes = list(
+        Favourites.objects.filter(user=instance).values_list(
+            'recipe_id', flat=True
+        )
+    )
+    instance._followed_authors = list(
+        Follow.objects.filter(user=instance).values_list(
+            'author_id', flat=True
+        )
+    )
+
+
+@receiver(post_delete, sender=User)
+def recount_user_counters(instance, **kwargs):
+    """Избранное и подписки удаляются каскадом, счетчики пересчитываются."""
+    recipe_ids = getattr(instance, '_favourite_recipes', ())
+    if recipe_ids:
+        Recipe.objects.filter(pk__in=recipe_ids).recount_favourites()
+    author_ids = getattr(instance, '_followed_authors', ())
+    if author_ids:
+        User.objects.filter(pk__in=author_ids).recount_followers()
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+def bump_ingredients_version(**kwargs):
+    ResourceVersion.objects.bump('ingredients')
+
+
+@receiver((post_save, post_delete), sender=Tag)
+def bump_tags_version(**kwargs):
+    ResourceVersion.objects.bump('tags')
+
+
+@receiver(pre_save, sender=Recipe)
+def bump_recipe_version(instance, **kwargs):
+    if instance.pk:
+        instance.version = F('version') + 1
+
+
+@receiver(post_save, sender=Recipe)
+def refresh_recipe_version(instance, **kwargs):
+    """Вместо выражения F в экземпляре остается записанная версия."""
+    if hasattr(instance.version, 'resolve_expression'):
+        instance.refresh_from_db(fields=('version',))
+
+
+@receiver(post_save, sender=Recipe)
+def update_recipe_search_index(instance, created, **kwargs):
+    """Новый рецепт индексируется после фиксации транзакции.
+
+    К этому моменту ингредиенты уже добавлены: сериализатором, инлайном
+    админки или фикстурой.
+    """
+    recipes = Recipe.objects.filter(pk=instance.pk)
+    if created:
+        transaction.on_commit(recipes.update_search_index)
+    else:
+        recipes.update_search_index()
+
+
+@receiver(post_save, sender=Ingredient)
+def update_ingredient_recipes_search_index(instance, created, **kwargs):
+    if not created:
+        Recipe.objects.filter(
+            recipe__ingredient=instance
+        ).update_search_index()
+
+
+@receiver(post_init, sender=Recipe)
+def remember_recipe_image(instance, **kwargs):
+    """Запоминает сохраненное имя картинки, не читая отложенное поле."""
+    instance._stored_image_name = instance.__dict__.get('image')
+
+
+@receiver(post_save, sender=Recipe)
+def process_recipe_image(instance, update_fields=None, **kwargs):
+    """Новая картинка уходит на обработку после фиксации транзакции.
+
+    Замена картинки любым save(), в том числе из админки, сбрасывает
+    has_image_variants, иначе адреса указывали бы на варианты, которых
+    для нового файла еще нет.
+    """
+    if 'image' not in instance.__dict__ or not instance.image:
+        return
+    name = instance.image.name
+    if name != instance._stored_image_name:
+        instance._stored_image_name = name
+        if instance.has_image_variants:
+            Recipe.objects.filter(pk=instance.pk).update(
+                has_image_variants=False
+            )
+            instance.has_image_variants = False
+    elif instance.has_image_variants or (
+        update_fields is not None and 'image' not in update_fields
+    ):
+        return
+    transaction.on_commit(lambda: image_pipeline.submit(name))
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+@receiver((post_save, post_delete), sender=IngredientsInRecipe)
+@receiver((post_save, post_delete), sender=Tag)
+@receiver((post_save, post_delete), sender=Ingredient)
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def invalidate_recipe_feed(**kwargs):
+    transaction.on_commit(recipe_feed_cache.invalidate)
+
+
+@receiver(post_save, sender=User)
+def invalidate_recipe_feed_for_author(
+    instance, created, update_fields=None, **kwargs
+):
+    """В списке рецептов есть только логин, имя и почта автора.
+
+    Удаление автора сбрасывает кэш через каскадное удаление его рецептов.
+    """
+    if created or (
+        update_fields is not None
+        and not FEED_AUTHOR_FIELDS.intersection(update_fields)
+    ):
+        return
+    if Recipe.objects.filter(author=instance).exists():
+        transaction.on_commit(recipe_feed_cache.invalidate)
+
+
+@receiver(post_delete, sender=Token)
+def forget_token(instance, **kwargs):
+    transaction.on_commit(lambda: token_cache.delete(instance.key))
+
+
+@receiver(post_save, sender=User)
+def forget_user_tokens(instance, update_fields=None, **kwargs):
+    """Смена пароля или деактивация сразу отзывает закэшированный токен."""
+    if update_fields and set(update_fields) <= {'last_login'}:
+        return
+    transaction.on_commit(lambda: token_cache.forget_user(instance.pk))
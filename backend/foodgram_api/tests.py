@@ -0,0 +1,385 @@
+import base64
+import io
+import shutil
+import tempfile
+
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.test import override_settings
+from PIL import Image
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from recipes.models import (Favourites, Ingredient, IngredientsInRecipe,
+                            Recipe, ShoppingCart, ShoppingListItem, Tag,
+                            TimelineEntry)
+from users.models import Follow, User
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+def make_image(color='red'):
+    buffer = io.BytesIO()
+    Image.new('RGB', (40, 30), color).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def make_base64_image(color='red'):
+    encoded = base64.b64encode(make_image(color)).decode()
+    return f'data:image/png;base64,{encoded}'
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, RECIPE_IMAGE_WORKERS=0)
+class FoodgramAPITestCase(APITestCase):
+    """Пользователи, ингредиенты и теги для тестов API."""
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='reader', email='reader@test.ru', password='pass'
+        )
+        cls.author = User.objects.create_user(
+            username='author', email='author@test.ru', password='pass'
+        )
+        cls.flour = Ingredient.objects.create(
+            name='мука', measurement_unit='г'
+        )
+        cls.milk = Ingredient.objects.create(
+            name='молоко', measurement_unit='мл'
+        )
+        # save() у Tag не работает из-за image_field у ColorField.
+        Tag.objects.bulk_create((
+            Tag(name='Завтрак', color='#E26C2D', slug='breakfast'),
+            Tag(name='Обед', color='#49B64E', slug='lunch'),
+        ))
+        cls.tag = Tag.objects.get(slug='breakfast')
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(self.user)
+
+    def create_recipe(self, amounts=None, name='Блины', author=None):
+        """Рецепт через API, как его создает пользователь."""
+        if amounts is None:
+            amounts = {self.flour: 200, self.milk: 500}
+        self.client.force_authenticate(author or self.author)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/recipes/', {
+                'ingredients': [
+                    {'id': ingredient.id, 'amount': amount}
+                    for ingredient, amount in amounts.items()
+                ],
+                'tags': [self.tag.id],
+                'image': make_base64_image(),
+                'name': name,
+                'text': 'Описание',
+                'cooking_time': 15,
+            }, format='json')
+        self.client.force_authenticate(self.user)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return Recipe.objects.get(pk=response.data['id'])
+
+
+class RecipeTests(FoodgramAPITestCase):
+
+    def test_create_and_retrieve(self):
+        recipe = self.create_recipe()
+        response = self.client.get(f'/api/recipes/{recipe.id}/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            {row['id']: row['amount'] for row in response.data['ingredients']},
+            {self.flour.id: 200, self.milk.id: 500}
+        )
+        self.assertFalse(response.data['is_favorited'])
+
+    def test_partial_update_requires_ingredients_and_tags(self):
+        recipe = self.create_recipe()
+        self.client.force_authenticate(self.author)
+        response = self.client.patch(
+            f'/api/recipes/{recipe.id}/', {'name': 'Оладьи'}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_update_by_other_user_is_forbidden(self):
+        recipe = self.create_recipe()
+        response = self.client.patch(
+            f'/api/recipes/{recipe.id}/', {'name': 'Оладьи'}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_save_keeps_integer_version(self):
+        recipe = self.create_recipe()
+        version = recipe.version
+        recipe.name = 'Оладьи'
+        recipe.save()
+        self.assertEqual(recipe.version, version + 1)
+
+    def test_replacing_image_resets_variants(self):
+        recipe = self.create_recipe()
+        recipe.refresh_from_db()
+        self.assertTrue(recipe.has_image_variants)
+        recipe.image = ContentFile(make_image('blue'), name='new.png')
+        with self.captureOnCommitCallbacks() as callbacks:
+            recipe.save()
+        self.assertFalse(
+            Recipe.objects.get(pk=recipe.pk).has_image_variants
+        )
+        for callback in callbacks:
+            callback()
+        self.assertTrue(Recipe.objects.get(pk=recipe.pk).has_image_variants)
+
+
+class ConditionalGetTests(FoodgramAPITestCase):
+
+    def test_recipe_etag(self):
+        recipe = self.create_recipe()
+        url = f'/api/recipes/{recipe.id}/'
+        etag = self.client.get(url)['ETag']
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.client.post(f'/api/recipes/{recipe.id}/favorite/')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_recipe_etag_changes_after_update(self):
+        recipe = self.create_recipe()
+        url = f'/api/recipes/{recipe.id}/'
+        self.client.force_authenticate(self.author)
+        etag = self.client.get(url)['ETag']
+        self.client.patch(url, {
+            'ingredients': [{'id': self.flour.id, 'amount': 300}],
+            'tags': [self.tag.id],
+        }, format='json')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_tags_etag(self):
+        etag = self.client.get('/api/tags/')['ETag']
+        response = self.client.get('/api/tags/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        Tag.objects.filter(slug='lunch').delete()
+        response = self.client.get('/api/tags/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class FavouritesTests(FoodgramAPITestCase):
+
+    def test_toggle(self):
+        recipe = self.create_recipe()
+        url = f'/api/recipes/{recipe.id}/favorite/'
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['id'], recipe.id)
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(
+            Recipe.objects.get(pk=recipe.pk).favourites_count, 1
+        )
+        response = self.client.delete(url)
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        response = self.client.delete(url)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Favourites.objects.exists())
+        self.assertEqual(
+            Recipe.objects.get(pk=recipe.pk).favourites_count, 0
+        )
+
+    def test_unknown_recipe(self):
+        url = '/api/recipes/999999/favorite/'
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.delete(url)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_anonymous(self):
+        recipe = self.create_recipe()
+        self.client.force_authenticate(None)
+        response = self.client.post(f'/api/recipes/{recipe.id}/favorite/')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class ShoppingCartTests(FoodgramAPITestCase):
+
+    def get_amounts(self):
+        return dict(
+            ShoppingListItem.objects.filter(user=self.user).values_list(
+                'ingredient_id', 'amount'
+            )
+        )
+
+    def test_toggle_updates_shopping_list(self):
+        pancakes = self.create_recipe()
+        bread = self.create_recipe({self.flour: 500}, name='Хлеб')
+        response = self.client.post(
+            f'/api/recipes/{pancakes.id}/shopping_cart/'
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.client.post(f'/api/recipes/{bread.id}/shopping_cart/')
+        self.assertEqual(
+            self.get_amounts(), {self.flour.id: 700, self.milk.id: 500}
+        )
+        response = self.client.post(
+            f'/api/recipes/{bread.id}/shopping_cart/'
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.get_amounts()[self.flour.id], 700)
+        response = self.client.delete(
+            f'/api/recipes/{pancakes.id}/shopping_cart/'
+        )
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self.get_amounts(), {self.flour.id: 500})
+        response = self.client.delete(
+            f'/api/recipes/{pancakes.id}/shopping_cart/'
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_recipe_update_changes_shopping_list(self):
+        recipe = self.create_recipe()
+        self.client.post(f'/api/recipes/{recipe.id}/shopping_cart/')
+        self.client.force_authenticate(self.author)
+        self.client.patch(f'/api/recipes/{recipe.id}/', {
+            'ingredients': [{'id': self.flour.id, 'amount': 300}],
+            'tags': [self.tag.id],
+        }, format='json')
+        self.assertEqual(self.get_amounts(), {self.flour.id: 300})
+
+    def test_download(self):
+        recipe = self.create_recipe()
+        ShoppingCart.objects.create(user=self.user, recipe=recipe)
+        ShoppingListItem.objects.rebuild((self.user.id,))
+        response = self.client.get(
+            '/api/recipes/download_shopping_cart/', HTTP_ACCEPT='text/csv'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        content = b''.join(response.streaming_content).decode()
+        self.assertIn('мука', content)
+        self.assertIn('200', content)
+
+
+class SubscriptionTests(FoodgramAPITestCase):
+
+    def test_toggle(self):
+        url = f'/api/users/{self.author.id}/subscribe/'
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertTrue(response.data['is_subscribed'])
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(
+            User.objects.get(pk=self.author.pk).followers_count, 1
+        )
+        response = self.client.delete(url)
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        response = self.client.delete(url)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(
+            User.objects.get(pk=self.author.pk).followers_count, 0
+        )
+
+    def test_self_and_unknown_author(self):
+        response = self.client.post(f'/api/users/{self.user.id}/subscribe/')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Follow.objects.exists())
+        url = '/api/users/999999/subscribe/'
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.delete(url)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_feed_backfill_and_trim(self):
+        recipes = [self.create_recipe(name=f'Рецепт {i}') for i in range(3)]
+        self.client.post(f'/api/users/{self.author.id}/subscribe/')
+        response = self.client.get('/api/recipes/feed/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [recipe['id'] for recipe in response.data['results']],
+            [recipe.id for recipe in reversed(recipes)]
+        )
+        response = self.client.get('/api/recipes/feed/?limit=2')
+        self.assertIsNotNone(response.data['next'])
+        response = self.client.get(
+            f'/api/recipes/feed/?before={recipes[1].id}'
+        )
+        self.assertEqual(
+            [recipe['id'] for recipe in response.data['results']],
+            [recipes[0].id]
+        )
+        self.client.delete(f'/api/users/{self.author.id}/subscribe/')
+        self.assertFalse(TimelineEntry.objects.filter(user=self.user).exists())
+        response = self.client.get('/api/recipes/feed/')
+        self.assertEqual(response.data['results'], [])
+
+    def test_new_recipe_reaches_feed(self):
+        self.client.post(f'/api/users/{self.author.id}/subscribe/')
+        recipe = self.create_recipe()
+        response = self.client.get('/api/recipes/feed/')
+        self.assertEqual(
+            [recipe['id'] for recipe in response.data['results']],
+            [recipe.id]
+        )
+
+    def test_subscriptions_list(self):
+        self.create_recipe()
+        self.create_recipe(name='Хлеб')
+        self.client.post(f'/api/users/{self.author.id}/subscribe/')
+        response = self.client.get('/api/users/subscriptions/?recipes_limit=1')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        author, = response.data['results']
+        self.assertEqual(author['recipes_count'], 2)
+        self.assertEqual(len(author['recipes']), 1)
+        response = self.client.get(
+            '/api/users/subscriptions/?recipes_limit=abc'
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class SearchTests(FoodgramAPITestCase):
+
+    def search(self, query):
+        response = self.client.get('/api/recipes/', {'search': query})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [recipe['id'] for recipe in response.data['results']]
+
+    def test_search_by_name_and_ingredient(self):
+        pancakes = self.create_recipe()
+        bread = self.create_recipe({self.flour: 500}, name='Хлеб')
+        self.assertEqual(self.search('хлеб'), [bread.id])
+        self.assertEqual(set(self.search('мука')), {pancakes.id, bread.id})
+        self.assertEqual(self.search('молоко'), [pancakes.id])
+        self.assertEqual(self.search('борщ'), [])
+
+    def test_recipe_created_outside_api_is_indexed(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe = Recipe.objects.create(
+                author=self.author, name='Омлет', text='Описание',
+                cooking_time=5,
+                image=ContentFile(make_image(), name='omelette.png')
+            )
+            IngredientsInRecipe.objects.create(
+                recipe=recipe, ingredient=self.milk, amount=100
+            )
+        self.assertEqual(self.search('омлет'), [recipe.id])
+        self.assertEqual(self.search('молоко'), [recipe.id])
+
+    def test_what_to_cook(self):
+        pancakes = self.create_recipe()
+        bread = self.create_recipe({self.flour: 500}, name='Хлеб')
+        response = self.client.get(
+            '/api/recipes/what_to_cook/', {'ingredients': self.flour.id}
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [
+                (recipe['id'], recipe['coverage'])
+                for recipe in response.data['results']
+            ],
+            [(bread.id, 1.0), (pancakes.id, 0.5)]
+        )
+        response = self.client.get('/api/recipes/what_to_cook/')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
@@ -4,7 +4,8 @@ from rest_framework import routers
 from .views import (CastomUserViewSet, FavouritesViewSet, IngredientViewSet,
                     RecipeViewSet, ShoppingCartViewSet,
                     SubscriptionUserViewSet, TagViewSet,
-                    download_shopping_cart, users_me)
+                    download_shopping_cart, favorite_batch, metrics,
+                    shopping_cart_batch, subscribe_batch, users_me)
 
 router_v1 = routers.DefaultRouter()
 router_v1.register(
@@ -40,6 +41,10 @@ router_v1.register('recipes', RecipeViewSet, basename='recipes')
 
 urlpatterns = [
     path('users/me/', users_me),
+    path('metrics/', metrics),
+    path('users/subscribe/', subscribe_batch),
+    path('recipes/favorite/', favorite_batch),
+    path('recipes/shopping_cart/', shopping_cart_batch),
     path('recipes/download_shopping_cart/', download_shopping_cart),
     path('', include(router_v1.urls)),
     path('auth/', include('djoser.urls.authtoken')),
@@ -1,76 +1,233 @@
-import base64
+import sqlite3
 
-from django.core.files.base import ContentFile
+from django.db import connections, router, transaction
+from django.db.models.sql import InsertQuery
 from django.shortcuts import get_object_or_404
 from rest_framework import serializers, status
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
+
+from .images import decode_base64_image, validate_dimensions, variant_name
+
+RECIPE_PREVIEW_FIELDS = ('id', 'name', 'image', 'cooking_time',
+                         'has_image_variants')
+
+
+def compile_insert_ignore(instances):
+    model = type(instances[0])
+    query = InsertQuery(model, ignore_conflicts=True)
+    query.insert_values(
+        [
+            field for field in model._meta.local_concrete_fields
+            if not field.primary_key
+        ],
+        instances
+    )
+    connection = connections[router.db_for_write(model)]
+    return connection, query.get_compiler(connection=connection).as_sql()
+
+
+def insert_ignore(instance):
+    """Сохраняет новый объект одним INSERT ... ON CONFLICT DO NOTHING.
+
+    Возвращает False, если такая строка уже есть: повторный или
+    одновременный запрос не падает с IntegrityError.
+    """
+    connection, statements = compile_insert_ignore([instance])
+    with connection.cursor() as cursor:
+        for sql, params in statements:
+            cursor.execute(sql, params)
+        return cursor.rowcount > 0
+
+
+def can_return_inserted(connection):
+    return connection.vendor == 'postgresql' or (
+        connection.vendor == 'sqlite'
+        and sqlite3.sqlite_version_info >= (3, 35)
+    )
+
+
+def insert_ignore_many(instances, field_name):
+    """Вставляет объекты одним INSERT ... ON CONFLICT DO NOTHING RETURNING.
+
+    Возвращает множество значений поля field_name у вставленных строк,
+    уже существующие строки пропускаются. Где RETURNING недоступен,
+    объекты вставляются по одному.
+    """
+    if not instances:
+        return set()
+    connection, statements = compile_insert_ignore(instances)
+    if not can_return_inserted(connection):
+        return {
+            getattr(instance, field_name)
+            for instance in instances if insert_ignore(instance)
+        }
+    column = connection.ops.quote_name(
+        type(instances[0])._meta.get_field(field_name).column
+    )
+    inserted = set()
+    with connection.cursor() as cursor:
+        for sql, params in statements:
+            cursor.execute(f'{sql} RETURNING {column}', params)
+            inserted.update(value for value, in cursor.fetchall())
+    return inserted
+
+
+def already_exists(message):
+    return serializers.ValidationError(
+        {api_settings.NON_FIELD_ERRORS_KEY: [message]}
+    )
+
+
+def get_recipes_limit(request):
+    """Параметр recipes_limit: сколько рецептов автора показать, или None."""
+    recipes_limit = request.query_params.get('recipes_limit')
+    if not recipes_limit:
+        return None
+    try:
+        recipes_limit = int(recipes_limit)
+    except ValueError:
+        raise serializers.ValidationError('Параметр recipes_limit - число!')
+    if recipes_limit < 0:
+        raise serializers.ValidationError(
+            'Параметр recipes_limit не может быть отрицательным!'
+        )
+    return recipes_limit
 
 
 def create_instans(request, id, serializer_name, model):
-    recipe = model.objects.filter(id=id).exists()
-    if not recipe:
+    recipe = model.objects.only(*RECIPE_PREVIEW_FIELDS).filter(id=id).first()
+    if recipe is None:
         return Response(status=status.HTTP_400_BAD_REQUEST)
-    serializer = serializer_name(
-        data={
-            'user': request.user.id,
-            'recipe': get_object_or_404(model, id=id).id
-        },
-        context={"request": request}
-    )
+    serializer = serializer_name(data={}, context={'request': request})
     serializer.is_valid(raise_exception=True)
-    serializer.save()
+    serializer.save(user=request.user, recipe=recipe)
     return Response(serializer.data, status=status.HTTP_201_CREATED)
 
 
 def delete_instans(request, id, model, related_model):
-    if not related_model.objects.filter(
-        user=request.user, recipe=get_object_or_404(model, pk=id)
-    ).exists():
+    deleted, _ = related_model.objects.filter(
+        user=request.user, recipe_id=id
+    ).delete()
+    if not deleted:
+        get_object_or_404(model, pk=id)
         return Response(status=status.HTTP_400_BAD_REQUEST)
-    related_model.objects.get(user=request.user.id, recipe=id).delete()
     return Response(status=status.HTTP_204_NO_CONTENT)
 
 
+def create_batch(user, ids, targets, relation_model, field, on_created,
+                 errors=None):
+    """Создает связи пользователя с объектами ids одним INSERT.
+
+    targets - queryset объектов, с которыми можно связаться, field - имя
+    внешнего ключа на них в relation_model. on_created получает список
+    объектов, связи с которыми действительно созданы. Для каждого id
+    возвращается статус: created, exists, not_found или значение из errors.
+    """
+    errors = errors or {}
+    found = targets.in_bulk([pk for pk in ids if pk not in errors])
+    with transaction.atomic():
+        created = insert_ignore_many(
+            [
+                relation_model(user=user, **{field: target})
+                for target in found.values()
+            ],
+            f'{field}_id'
+        )
+        if created:
+            on_created([found[pk] for pk in created])
+    return Response({'results': [
+        {
+            'id': pk,
+            'status': errors.get(pk) or (
+                'created' if pk in created
+                else 'exists' if pk in found else 'not_found'
+            )
+        }
+        for pk in ids
+    ]})
+
+
+def delete_batch(user, ids, targets, relation_model, field, on_deleted):
+    """Удаляет связи пользователя с объектами ids одним DELETE.
+
+    Удаляемые связи блокируются, поэтому одновременные запросы не
+    удалят одну связь дважды. on_deleted получает список id объектов,
+    связи с которыми удалены. Статусы: deleted, absent или not_found.
+    """
+    lookup = f'{field}_id__in'
+    with transaction.atomic():
+        deleted = set(relation_model.objects.select_for_update().filter(
+            user=user, **{lookup: ids}
+        ).values_list(f'{field}_id', flat=True))
+        if deleted:
+            relation_model.objects.filter(
+                user=user, **{lookup: deleted}
+            ).delete()
+            on_deleted(list(deleted))
+    missing = [pk for pk in ids if pk not in deleted]
+    existing = set(targets.filter(pk__in=missing).values_list(
+        'pk', flat=True
+    )) if missing else set()
+    return Response({'results': [
+        {
+            'id': pk,
+            'status': (
+                'deleted' if pk in deleted
+                else 'absent' if pk in existing else 'not_found'
+            )
+        }
+        for pk in ids
+    ]})
+
+
 def ingredient_valid(serializers, data, ingredient_model):
+    """Проверяет ингредиенты рецепта одним запросом.
+
+    Возвращает словарь {id: ингредиент}; все ошибки собираются
+    в одно сообщение.
+    """
     if not data.get('recipe'):
         raise serializers.ValidationError(
             'Добавьте хотя бы один ингредиент!'
         )
-    ingredients_list = []
-    for ingredient in data.get('recipe'):
-        if ingredient.get('amount') < 1:
-            raise serializers.ValidationError(
-                'Количество ингредиентов не может быть меньше 1!'
-            )
-        if not ingredient_model.objects.filter(
-            id=ingredient.get('id')
-        ).exists():
-            raise serializers.ValidationError(
-                'Выбран несуществующий ингредиент!'
-            )
-        ingredients_list.append(ingredient.get('id'))
+    ingredients_list = [ingredient.get('id') for ingredient in data['recipe']]
+    errors = []
+    if any(ingredient.get('amount') < 1 for ingredient in data['recipe']):
+        errors.append('Количество ингредиентов не может быть меньше 1!')
     if len(set(ingredients_list)) != len(ingredients_list):
-        raise serializers.ValidationError(
-            'Ингредиенты не могут повторяться!'
+        errors.append('Ингредиенты не могут повторяться!')
+    ingredients = ingredient_model.objects.in_bulk(ingredients_list)
+    missing = sorted(set(ingredients_list) - set(ingredients))
+    if missing:
+        errors.append(
+            'Выбраны несуществующие ингредиенты: '
+            f'{", ".join(map(str, missing))}!'
         )
+    if errors:
+        raise serializers.ValidationError(errors)
+    return ingredients
 
 
-def tag_valid(serializers, data, ingredient_model):
+def tag_valid(serializers, data, tag_model):
+    """Проверяет теги рецепта одним запросом и возвращает их список."""
     if not data.get('tags'):
         raise serializers.ValidationError(
             'Добавьте хотя бы один тег!'
         )
-    tags_list = []
-    for tag in data.get('tags'):
-        if tag in tags_list:
-            raise serializers.ValidationError(
-                'Теги не могут повторяться!'
-            )
-        if not ingredient_model.objects.filter(id=tag.id).exists():
-            raise serializers.ValidationError(
-                'Выбран несуществующий тег!'
-            )
-        tags_list.append(tag)
+    tags_list = data['tags']
+    errors = []
+    if len(set(tags_list)) != len(tags_list):
+        errors.append('Теги не могут повторяться!')
+    tags = tag_model.objects.in_bulk(tags_list)
+    missing = sorted(set(tags_list) - set(tags))
+    if missing:
+        errors.append(
+            f'Выбраны несуществующие теги: {", ".join(map(str, missing))}!'
+        )
+    if errors:
+        raise serializers.ValidationError(errors)
+    return [tags[tag_id] for tag_id in dict.fromkeys(tags_list)]
 
 
 class Base64ImageField(serializers.ImageField):
@@ -78,7 +235,28 @@ class Base64ImageField(serializers.ImageField):
 
     def to_internal_value(self, data):
         if isinstance(data, str) and data.startswith('data:image'):
-            format, imgstr = data.split(';base64,')
-            ext = format.split('/')[-1]
-            data = ContentFile(base64.b64decode(imgstr), name='temp.' + ext)
+            data = decode_base64_image(data)
+        if hasattr(data, 'seek'):
+            validate_dimensions(data)
         return super().to_internal_value(data)
+
+
+class RecipeImageField(serializers.ImageField):
+    """Адрес уменьшенной копии картинки рецепта.
+
+    Пока копия не создана фоновой обработкой, отдается оригинал.
+    """
+
+    def __init__(self, variant, **kwargs):
+        self.variant = variant
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        if value and getattr(value.instance, 'has_image_variants', False):
+            value = value.field.attr_class(
+                value.instance,
+                value.field,
+                variant_name(value.name, self.variant)
+            )
+        return super().to_representation(value)
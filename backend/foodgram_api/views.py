@@ -1,24 +1,42 @@
-from django.db.models import Sum
-from django.http import HttpResponse
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.http import HttpResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import UserViewSet
 from rest_framework import mixins, status, viewsets
-from rest_framework.decorators import api_view, permission_classes
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.decorators import (action, api_view, permission_classes,
+                                       renderer_classes)
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 
-from recipes.models import (Favourites, Ingredient, IngredientsInRecipe,
-                            Recipe, ShoppingCart, Tag)
+from recipes.models import (Favourites, Ingredient, Recipe, ShoppingCart,
+                            ShoppingListItem, Tag, TimelineEntry)
 from users.models import Follow, User
 
-from .filters import IngredientFilter, RecipeFilter
-from .permissions import IsAuthorOrReadOnly
-from .serializers import (CastomUserSerializer, FavouritesSerializer,
+from .caching import (ConditionalGetMixin, TableVersionETagMixin,
+                      add_user_flags, get_recipe_etag, recipe_feed_cache,
+                      set_user_flags)
+from .exporters import EXPORTERS, SHOPPING_LIST_RENDERERS, get_shopping_list
+from .filters import IngredientFilter, RecipeFilter, UserFilter
+from .metrics import registry
+from .paginator import CastomPageNumberPagination, CursorPaginationMixin
+from .permissions import HasMetricsToken, IsAuthorOrReadOnly
+from .search import ingredient_index, recipe_ingredient_index
+from .serializers import (BatchSerializer, CastomUserSerializer,
+                          FavouritesSerializer,
                           FollowSerializer, IngredientSerializer,
-                          RecipeCreateSerializer, RecipeReadSerializer,
-                          ShoppingCartSerializer, TagSerializer)
-from .utils import create_instans, delete_instans
+                          RecipeCreateSerializer, RecipeMatchSerializer,
+                          RecipeReadSerializer, ShoppingCartSerializer,
+                          TagSerializer)
+from .utils import (already_exists, create_batch, create_instans,
+                    delete_batch, delete_instans, get_recipes_limit,
+                    insert_ignore)
 
 
 class CastomUserViewSet(UserViewSet):
@@ -30,20 +48,26 @@ class CastomUserViewSet(UserViewSet):
 
     queryset = User.objects.all()
     serializer_class = CastomUserSerializer
+    filter_backends = (DjangoFilterBackend,)
+    filterset_class = UserFilter
+
+    def get_queryset(self):
+        """Флаг is_subscribed одним подзапросом на всю страницу."""
+        return super().get_queryset().with_is_subscribed(self.request.user)
 
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def users_me(request):
     """Просмотр своего профиля."""
-    user = get_object_or_404(User, username=request.user)
     serializer = CastomUserSerializer(
-        user, context={'request': request}
+        request.user, context={'request': request}
     )
     return Response(serializer.data, status=status.HTTP_200_OK)
 
 
 class SubscriptionUserViewSet(
+    CursorPaginationMixin,
     mixins.CreateModelMixin,
     mixins.DestroyModelMixin,
     mixins.ListModelMixin,
@@ -59,13 +83,29 @@ class SubscriptionUserViewSet(
     permission_classes = (IsAuthorOrReadOnly, IsAuthenticated)
 
     def get_queryset(self):
-        """Возвращает queryset в зависимости от значения параметра limit."""
-        queryset = User.objects.filter(following__user=self.request.user)
-        limit = self.request.query_params.get('limit')
-        if limit:
-            queryset = queryset[:int(limit)]
-        return queryset
+        """Авторы, на которых подписан пользователь.
+
+        Размер страницы задается параметром limit через пагинацию.
+        """
+        return User.objects.followed_by(self.request.user)
+
+    def list(self, request, *args, **kwargs):
+        """Список подписок с превью рецептов за постоянное число запросов.
+
+        Рецепты всех авторов страницы выбираются одним запросом
+        (не более recipes_limit на автора).
+        """
+        page = self.paginate_queryset(self.filter_queryset(
+            self.get_queryset()
+        ))
+        context = self.get_serializer_context()
+        context['recipes'] = Recipe.objects.latest_by_author(
+            [author.id for author in page], get_recipes_limit(request)
+        )
+        serializer = self.get_serializer(page, many=True, context=context)
+        return self.get_paginated_response(serializer.data)
 
+    @transaction.atomic
     def create(self, request, id):
         """Создание новой подписки."""
         author = get_object_or_404(User, pk=id)
@@ -73,20 +113,30 @@ class SubscriptionUserViewSet(
             author, data=request.data, context={"request": request}
         )
         serializer.is_valid(raise_exception=True)
-        Follow.objects.create(user=self.request.user, author=author)
+        if not insert_ignore(Follow(user=request.user, author=author)):
+            raise already_exists('Вы уже подписаны на этого пользователя!')
+        author.is_subscribed = True
+        User.objects.filter(pk=author.pk).update(
+            followers_count=F('followers_count') + 1
+        )
+        TimelineEntry.objects.backfill(request.user, author)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
+    @transaction.atomic
     def delete(self, request, id):
         """Удаление подписки."""
-        if not Follow.objects.filter(
-            user=request.user, author=get_object_or_404(User, id=id)
-        ).exists():
+        deleted, _ = Follow.objects.filter(
+            user=request.user, author_id=id
+        ).delete()
+        if not deleted:
+            get_object_or_404(User, id=id)
             return Response(status=status.HTTP_400_BAD_REQUEST)
-        Follow.objects.get(user=request.user.id, author=id).delete()
+        change_followers_count((id,), -1)
+        TimelineEntry.objects.trim(request.user, id)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
-class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
+class IngredientViewSet(TableVersionETagMixin, viewsets.ReadOnlyModelViewSet):
     """Получение одного ингредиента или списка ингредиентов."""
 
     queryset = Ingredient.objects.all()
@@ -95,18 +145,31 @@ class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
     permission_classes = (AllowAny,)
     filter_backends = (DjangoFilterBackend,)
     filterset_class = IngredientFilter
+    version_resource = 'ingredients'
+
+    def list(self, request, *args, **kwargs):
+        """Поиск по названию идет через индекс в памяти, без запросов к БД."""
+        name = request.query_params.get('name')
+        if name and settings.INGREDIENT_SEARCH_INDEX:
+            return Response(ingredient_index.search(name))
+        return super().list(request, *args, **kwargs)
 
 
-class TagViewSet(viewsets.ReadOnlyModelViewSet):
+class TagViewSet(TableVersionETagMixin, viewsets.ReadOnlyModelViewSet):
     """Получение одного тега или списка тегов."""
 
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     pagination_class = None
     permission_classes = (AllowAny,)
+    version_resource = 'tags'
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(
+    CursorPaginationMixin,
+    ConditionalGetMixin,
+    viewsets.ModelViewSet
+):
     """Работа с рецептами.
 
     Получение одного рецепта или списка рецептов,
@@ -118,6 +181,125 @@ class RecipeViewSet(viewsets.ModelViewSet):
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeFilter
     http_method_names = ('get', 'post', 'patch', 'delete')
+    cache_control = 'private, no-cache'
+
+    def get_etag(self):
+        """ETag только для одного рецепта: он зависит от версии рецепта."""
+        pk = self.kwargs.get('pk')
+        if self.action != 'retrieve' or not str(pk).isdigit():
+            return None
+        return get_recipe_etag(pk, self.request.user)
+
+    def get_queryset(self):
+        """Для чтения возвращает рецепты с флагами текущего пользователя."""
+        if self.action in ('list', 'retrieve'):
+            return Recipe.objects.with_user_flags(self.request.user)
+        return Recipe.objects.all()
+
+    def list(self, request, *args, **kwargs):
+        """Список рецептов через кэш анонимных страниц.
+
+        В кэше хранится страница со сброшенными флагами пользователя.
+        При попадании пользователю отдается эта страница, дополненная его
+        флагами избранного, списка покупок и подписок.
+        """
+        if not recipe_feed_cache.is_cacheable(request):
+            return super().list(request, *args, **kwargs)
+        key = recipe_feed_cache.get_key(request)
+        payload = recipe_feed_cache.get(key)
+        if payload is not None:
+            if request.user.is_authenticated:
+                payload = add_user_flags(payload, request.user)
+            return Response(payload)
+        response = super().list(request, *args, **kwargs)
+        recipe_feed_cache.set(key, set_user_flags(response.data))
+        return response
+
+    @action(detail=False, permission_classes=(IsAuthenticated,))
+    def feed(self, request):
+        """Лента рецептов авторов, на которых подписан пользователь.
+
+        Пагинация по ключу: параметр before - id рецепта, после которого
+        продолжается лента, limit - размер страницы.
+        """
+        try:
+            limit = min(
+                int(request.query_params.get(
+                    'limit', settings.REST_FRAMEWORK['PAGE_SIZE']
+                )),
+                settings.RECIPE_FEED_MAX_LIMIT
+            )
+            before = request.query_params.get('before')
+            before = int(before) if before else None
+        except ValueError:
+            raise ValidationError('Параметры limit и before - числа!')
+        if limit < 1:
+            raise ValidationError('Параметр limit должен быть больше нуля!')
+        recipe_ids = TimelineEntry.objects.recipe_ids(
+            request.user, limit, before
+        )
+        recipes = Recipe.objects.with_user_flags(request.user).in_bulk(
+            recipe_ids
+        )
+        serializer = RecipeReadSerializer(
+            [recipes[pk] for pk in recipe_ids if pk in recipes],
+            many=True,
+            context={'request': request}
+        )
+        next_link = None
+        if len(recipe_ids) == limit:
+            next_link = replace_query_param(
+                request.build_absolute_uri(), 'before', recipe_ids[-1]
+            )
+        return Response({'next': next_link, 'results': serializer.data})
+
+    @action(detail=False, url_path='what_to_cook')
+    def what_to_cook(self, request):
+        """Рецепты по имеющимся ингредиентам.
+
+        Ингредиенты передаются параметром ingredients (несколько раз или
+        через запятую). Рецепты отсортированы по доле имеющихся
+        ингредиентов и подбираются по обратному индексу в памяти; из базы
+        читается только текущая страница.
+        """
+        try:
+            available = {
+                int(value)
+                for values in request.query_params.getlist('ingredients')
+                for value in values.split(',') if value.strip()
+            }
+        except ValueError:
+            raise ValidationError(
+                {'ingredients': 'Укажите id ингредиентов числами!'}
+            )
+        if not available:
+            raise ValidationError(
+                {'ingredients': 'Укажите хотя бы один ингредиент!'}
+            )
+        paginator = CastomPageNumberPagination()
+        page = paginator.paginate_queryset(
+            recipe_ingredient_index.match(available), request, view=self
+        )
+        recipes = Recipe.objects.with_user_flags(request.user).in_bulk(
+            [recipe_id for recipe_id, _ in page]
+        )
+        results = []
+        for recipe_id, coverage in page:
+            recipe = recipes.get(recipe_id)
+            if recipe is not None:
+                recipe.coverage = round(coverage, 4)
+                results.append(recipe)
+        serializer = RecipeMatchSerializer(
+            results,
+            many=True,
+            context={'request': request, 'available': available}
+        )
+        return paginator.get_paginated_response(serializer.data)
+
+    @action(detail=False, permission_classes=(IsAdminUser,))
+    def cache_stats(self, request):
+        """Статистика попаданий в кэш списка рецептов."""
+        return Response(recipe_feed_cache.get_stats())
 
     def get_serializer_class(self):
         """Возвращает queryset в зависимости от метода."""
@@ -125,6 +307,12 @@ class RecipeViewSet(viewsets.ModelViewSet):
             return RecipeReadSerializer
         return RecipeCreateSerializer
 
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        # Списки покупок и recipes_count автора обновляют сигналы
+        # удаления рецепта.
+        instance.delete()
+
 
 class FavouritesViewSet(
     mixins.CreateModelMixin,
@@ -139,9 +327,13 @@ class FavouritesViewSet(
         """Добавляет рецепт в избранное."""
         return create_instans(request, id, FavouritesSerializer, Recipe)
 
+    @transaction.atomic
     def delete(self, request, id):
         """Удаляет рецепт из избранного."""
-        return delete_instans(request, id, Recipe, Favourites)
+        response = delete_instans(request, id, Recipe, Favourites)
+        if response.status_code == status.HTTP_204_NO_CONTENT:
+            change_favourites_count((id,), -1)
+        return response
 
 
 class ShoppingCartViewSet(
@@ -157,27 +349,130 @@ class ShoppingCartViewSet(
         """Добавляет рецепт в список покупок."""
         return create_instans(request, id, ShoppingCartSerializer, Recipe)
 
+    @transaction.atomic
     def delete(self, request, id):
         """Удаляет рецепт из списка покупок."""
-        return delete_instans(request, id, Recipe, ShoppingCart)
+        response = delete_instans(request, id, Recipe, ShoppingCart)
+        if response.status_code == status.HTTP_204_NO_CONTENT:
+            ShoppingListItem.objects.remove_recipe((request.user.id,), id)
+        return response
 
 
 @api_view(['GET'])
+@renderer_classes(SHOPPING_LIST_RENDERERS)
 @permission_classes([IsAuthenticated])
 def download_shopping_cart(request):
-    """Скачивание списка покупок."""
-    ingredients = IngredientsInRecipe.objects.filter(
-        recipe__shoppingcart_recipe__user=request.user
-    ).values(
-        'ingredient__name', 'ingredient__measurement_unit'
-    ).annotate(ingredient_amount=Sum('amount'))
-    shopping_list = 'Список покупок:\n\n'
-    shopping_list += '\n'.join([
-        f'- {ingredient["ingredient__name"]}'
-        f'({ingredient["ingredient__measurement_unit"]})'
-        f' - {ingredient["ingredient_amount"]}'
-        for ingredient in ingredients
-    ])
-    response = HttpResponse(shopping_list, content_type='text.txt')
-    response['Content-Disposition'] = 'attachment; filename="shopping_cart"'
+    """Скачивание списка покупок.
+
+    Формат выгрузки задается параметром format или заголовком Accept:
+    txt (по умолчанию), csv, json или pdf.
+    """
+    exporter = EXPORTERS[request.accepted_renderer.format]()
+    rows = get_shopping_list(request.user)
+    if isinstance(request._request, ASGIRequest):
+        # Под ASGI потоковый ответ отдается из цикла событий, где Django
+        # 3.2 запрещает запросы к БД, поэтому строки читаются заранее.
+        rows = list(rows)
+    else:
+        rows = rows.iterator()
+    response = StreamingHttpResponse(
+        exporter.stream(rows), content_type=exporter.content_type
+    )
+    response['Content-Disposition'] = (
+        f'attachment; filename="shopping_cart.{exporter.extension}"'
+    )
     return response
+
+
+def get_batch_ids(request):
+    serializer = BatchSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    return serializer.validated_data['ids']
+
+
+def change_favourites_count(ids, delta):
+    """Меняет счетчик избранного, не опуская его ниже нуля."""
+    Recipe.objects.filter(pk__in=ids).update(
+        favourites_count=Greatest(F('favourites_count') + delta, 0)
+    )
+
+
+def change_followers_count(ids, delta):
+    """Меняет счетчик подписчиков, не опуская его ниже нуля."""
+    User.objects.filter(pk__in=ids).update(
+        followers_count=Greatest(F('followers_count') + delta, 0)
+    )
+
+
+@api_view(['POST', 'DELETE'])
+@permission_classes([IsAuthenticated])
+def favorite_batch(request):
+    """Добавление или удаление из избранного нескольких рецептов сразу."""
+    ids = get_batch_ids(request)
+    recipes = Recipe.objects.only('id')
+    if request.method == 'POST':
+        return create_batch(
+            request.user, ids, recipes, Favourites, 'recipe',
+            lambda created: change_favourites_count(
+                [recipe.pk for recipe in created], 1
+            )
+        )
+    return delete_batch(
+        request.user, ids, recipes, Favourites, 'recipe',
+        lambda deleted: change_favourites_count(deleted, -1)
+    )
+
+
+@api_view(['POST', 'DELETE'])
+@permission_classes([IsAuthenticated])
+def shopping_cart_batch(request):
+    """Добавление или удаление из списка покупок нескольких рецептов."""
+    ids = get_batch_ids(request)
+    recipes = Recipe.objects.only('id')
+    user_ids = (request.user.id,)
+    if request.method == 'POST':
+        return create_batch(
+            request.user, ids, recipes, ShoppingCart, 'recipe',
+            lambda created: ShoppingListItem.objects.add_recipe(
+                user_ids, *created
+            )
+        )
+    return delete_batch(
+        request.user, ids, recipes, ShoppingCart, 'recipe',
+        lambda deleted: ShoppingListItem.objects.remove_recipe(
+            user_ids, *deleted
+        )
+    )
+
+
+@api_view(['POST', 'DELETE'])
+@permission_classes([IsAuthenticated])
+def subscribe_batch(request):
+    """Подписка на нескольких авторов или отписка от них."""
+    ids = get_batch_ids(request)
+    authors = User.objects.only('id', 'followers_count')
+    user = request.user
+    if request.method == 'POST':
+        def subscribed(created):
+            change_followers_count([author.pk for author in created], 1)
+            TimelineEntry.objects.backfill(user, *created)
+
+        return create_batch(
+            user, ids, authors, Follow, 'author', subscribed,
+            errors={user.pk: 'self'}
+        )
+
+    def unsubscribed(deleted):
+        change_followers_count(deleted, -1)
+        TimelineEntry.objects.trim(user, *deleted)
+
+    return delete_batch(user, ids, authors, Follow, 'author', unsubscribed)
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser | HasMetricsToken])
+def metrics(request):
+    """Гистограммы запросов процесса в текстовом формате Prometheus."""
+    return HttpResponse(
+        registry.render(), content_type='text/plain; version=0.0.4'
+    )
@@ -1,6 +1,11 @@
 from django.contrib import admin
+from django.db.models import F
+from django.db.models.functions import Greatest
 
-from .models import Favourites, Ingredient, Recipe, ShoppingCart, Tag
+from users.models import User
+
+from .models import (Favourites, Ingredient, Recipe, ShoppingCart,
+                     ShoppingListItem, Tag)
 
 
 @admin.register(Ingredient)
@@ -36,9 +41,21 @@ class RecipeAdmin(admin.ModelAdmin):
     empty_value_display = '-пусто-'
 
     def number_in_favorites(self, obj):
-        return obj.favorite_recipe.count()
+        return obj.favourites_count
 
     number_in_favorites.short_description = 'В избранном'
+    number_in_favorites.admin_order_field = 'favourites_count'
+
+    def save_model(self, request, obj, form, change):
+        """При смене автора переносит рецепт в его recipes_count."""
+        super().save_model(request, obj, form, change)
+        if change and 'author' in form.changed_data:
+            User.objects.filter(pk=form.initial['author']).update(
+                recipes_count=Greatest(F('recipes_count') - 1, 0)
+            )
+            User.objects.filter(pk=obj.author_id).update(
+                recipes_count=F('recipes_count') + 1
+            )
 
 
 @admin.register(Favourites)
@@ -51,6 +68,21 @@ class FavouritesAdmin(admin.ModelAdmin):
     list_filter = ('user', 'recipe')
     empty_value_display = '-пусто-'
 
+    def save_model(self, request, obj, form, change):
+        """Пересчитывает favourites_count прежнего и нового рецепта."""
+        recipe_ids = {obj.recipe_id, form.initial.get('recipe')} - {None}
+        super().save_model(request, obj, form, change)
+        Recipe.objects.filter(pk__in=recipe_ids).recount_favourites()
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        Recipe.objects.filter(pk=obj.recipe_id).recount_favourites()
+
+    def delete_queryset(self, request, queryset):
+        recipe_ids = set(queryset.values_list('recipe_id', flat=True))
+        super().delete_queryset(request, queryset)
+        Recipe.objects.filter(pk__in=recipe_ids).recount_favourites()
+
 
 @admin.register(ShoppingCart)
 class ShoppingCartAdmin(admin.ModelAdmin):
@@ -61,3 +93,18 @@ class ShoppingCartAdmin(admin.ModelAdmin):
     search_fields = ('user', 'recipe')
     list_filter = ('user', 'recipe')
     empty_value_display = '-пусто-'
+
+    def save_model(self, request, obj, form, change):
+        """Пересчитывает списки покупок прежнего и нового владельца."""
+        user_ids = {obj.user_id, form.initial.get('user')} - {None}
+        super().save_model(request, obj, form, change)
+        ShoppingListItem.objects.rebuild(user_ids)
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        ShoppingListItem.objects.rebuild((obj.user_id,))
+
+    def delete_queryset(self, request, queryset):
+        user_ids = set(queryset.values_list('user_id', flat=True))
+        super().delete_queryset(request, queryset)
+        ShoppingListItem.objects.rebuild(user_ids)
@@ -4,3 +4,5 @@ MAX_COOKING_TIME = 360
 NAME_MAX_LENGTH = 200
 MEASUREMENT_UNIT_MAX_LENGTH = 200
 SLUG_MAX_LENGTH = 200
+SEARCH_CONFIG = 'russian'
+SEARCH_FTS_TABLE = 'recipes_recipe_search'
@@ -0,0 +1,167 @@
+import csv
+import io
+import json
+import time
+from itertools import islice
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from recipes.constants import MEASUREMENT_UNIT_MAX_LENGTH, NAME_MAX_LENGTH
+from recipes.models import Ingredient, ResourceVersion
+
+DEFAULT_PATH = Path(settings.BASE_DIR).parent / 'data/ingredients.csv'
+READ_SIZE = 64 * 1024
+
+
+def read_csv(file):
+    for row in csv.reader(file):
+        if len(row) >= 2:
+            yield row[0], row[1]
+
+
+def read_json(file):
+    """Потоково читает JSON-массив объектов с полями name и measurement_unit.
+
+    Объекты разбираются по одному по мере чтения файла, поэтому весь
+    массив в памяти не хранится.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    started = False
+    while True:
+        data = file.read(READ_SIZE)
+        buffer += data
+        while True:
+            buffer = buffer.lstrip()
+            if not started:
+                if not buffer:
+                    break
+                if buffer[0] != '[':
+                    raise CommandError('Ожидался JSON-массив ингредиентов.')
+                buffer = buffer[1:]
+                started = True
+                continue
+            if buffer[:1] == ',':
+                buffer = buffer[1:]
+                continue
+            if buffer[:1] == ']':
+                return
+            try:
+                item, end = decoder.raw_decode(buffer)
+            except json.JSONDecodeError:
+                if not data:
+                    raise CommandError('Некорректный JSON-файл ингредиентов.')
+                break
+            buffer = buffer[end:]
+            yield item['name'], item['measurement_unit']
+        if not data:
+            return
+
+
+READERS = {'.csv': read_csv, '.json': read_json}
+
+
+def clean_rows(rows):
+    for name, measurement_unit in rows:
+        name = name.strip()[:NAME_MAX_LENGTH]
+        measurement_unit = measurement_unit.strip()[
+            :MEASUREMENT_UNIT_MAX_LENGTH
+        ]
+        if name and measurement_unit:
+            yield name, measurement_unit
+
+
+def batches(rows, size):
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+class Command(BaseCommand):
+    help = (
+        'Загружает ингредиенты из CSV или JSON пачками. Уже существующие '
+        'пары (название, единица измерения) пропускаются, поэтому команду '
+        'можно запускать повторно.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', nargs='?', default=str(DEFAULT_PATH),
+            help='Файл .csv (название,единица) или .json с ингредиентами.'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=5000,
+            help='Количество строк в одной пачке.'
+        )
+        parser.add_argument(
+            '--no-copy', action='store_true',
+            help='Не использовать COPY на PostgreSQL.'
+        )
+
+    def insert_batch(self, batch):
+        Ingredient.objects.bulk_create(
+            (
+                Ingredient(name=name, measurement_unit=measurement_unit)
+                for name, measurement_unit in batch
+            ),
+            ignore_conflicts=True
+        )
+
+    def copy_batch(self, batch):
+        """Загружает пачку через COPY во временную таблицу."""
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(batch)
+        buffer.seek(0)
+        table = Ingredient._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'CREATE TEMP TABLE IF NOT EXISTS ingredient_import '
+                '(name text, measurement_unit text) ON COMMIT DELETE ROWS'
+            )
+            cursor.cursor.copy_expert(
+                'COPY ingredient_import (name, measurement_unit) '
+                'FROM STDIN WITH (FORMAT csv)',
+                buffer
+            )
+            cursor.execute(
+                f'INSERT INTO {table} (name, measurement_unit) '
+                f'SELECT DISTINCT name, measurement_unit '
+                f'FROM ingredient_import '
+                f'ON CONFLICT (name, measurement_unit) DO NOTHING'
+            )
+
+    def handle(self, *args, **options):
+        path = Path(options['path'])
+        reader = READERS.get(path.suffix.lower())
+        if reader is None:
+            raise CommandError('Поддерживаются только файлы .csv и .json.')
+        if not path.is_file():
+            raise CommandError(f'Файл {path} не найден.')
+        use_copy = (
+            connection.vendor == 'postgresql' and not options['no_copy']
+        )
+        load_batch = self.copy_batch if use_copy else self.insert_batch
+        before = Ingredient.objects.count()
+        started = time.perf_counter()
+        total = 0
+        with open(path, encoding='utf-8', newline='') as file:
+            for batch in batches(
+                clean_rows(reader(file)), options['batch_size']
+            ):
+                with transaction.atomic():
+                    load_batch(batch)
+                total += len(batch)
+        elapsed = time.perf_counter() - started
+        added = Ingredient.objects.count() - before
+        if added:
+            ResourceVersion.objects.bump('ingredients')
+        self.stdout.write(self.style.SUCCESS(
+            f'Прочитано строк: {total}, добавлено ингредиентов: {added} '
+            f'за {elapsed:.1f} с ({total / max(elapsed, 1e-9):.0f} строк/с).'
+        ))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает полнотекстовый поисковый индекс рецептов.'
+
+    def handle(self, *args, **options):
+        Recipe.objects.all().update_search_index()
+        self.stdout.write(
+            f'Поисковый индекс пересчитан: {Recipe.objects.count()} рецептов.'
+        )
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes.models import ShoppingListItem, shopping_list_totals
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчитывает списки покупок пользователей с нуля и проверяет, '
+        'что они совпадают с суммами по рецептам в корзинах.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help='Только проверить списки покупок, ничего не изменяя.'
+        )
+
+    def handle(self, *args, **options):
+        if not options['check']:
+            ShoppingListItem.objects.rebuild()
+            self.stdout.write('Списки покупок пересчитаны.')
+        expected = set(shopping_list_totals())
+        stored = set(ShoppingListItem.objects.values_list(
+            'user_id', 'ingredient_id', 'amount'
+        ))
+        if expected != stored:
+            raise CommandError(
+                f'Списки покупок не совпадают с корзинами: '
+                f'{len(expected - stored)} позиций отсутствуют или неверны, '
+                f'{len(stored - expected)} лишних.'
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f'Списки покупок совпадают с корзинами ({len(stored)} позиций).'
+        ))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from recipes.models import TimelineEntry
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает ленты подписок всех пользователей.'
+
+    def handle(self, *args, **options):
+        TimelineEntry.objects.rebuild()
+        self.stdout.write(
+            f'Ленты подписок пересобраны: {TimelineEntry.objects.count()} '
+            f'записей.'
+        )
@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from recipes.models import Favourites, Recipe
+from users.models import Follow, User
+
+# Модель, поле-счетчик, модель считаемых записей, поле связи с моделью.
+COUNTERS = (
+    (Recipe, 'favourites_count', Favourites, 'recipe'),
+    (User, 'recipes_count', Recipe, 'author'),
+    (User, 'followers_count', Follow, 'author'),
+)
+
+
+def actual_count(related_model, field):
+    return Coalesce(Subquery(
+        related_model.objects.filter(
+            **{field: OuterRef('pk')}
+        ).order_by().values(field).annotate(
+            total=Count('pk')
+        ).values('total')
+    ), 0)
+
+
+class Command(BaseCommand):
+    help = (
+        'Сверяет счетчики избранного, рецептов и подписчиков с данными '
+        'и исправляет расхождения.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help='Только проверить счетчики, ничего не изменяя.'
+        )
+
+    def handle(self, *args, **options):
+        mismatched = 0
+        for model, counter, related_model, field in COUNTERS:
+            wrong = model.objects.annotate(
+                actual=actual_count(related_model, field)
+            ).exclude(**{counter: F('actual')}).count()
+            mismatched += wrong
+            self.stdout.write(
+                f'{model.__name__}.{counter}: расхождений {wrong}.'
+            )
+            if wrong and not options['check']:
+                model.objects.update(
+                    **{counter: actual_count(related_model, field)}
+                )
+        if mismatched and options['check']:
+            raise CommandError(f'Неверных счетчиков: {mismatched}.')
+        self.stdout.write(self.style.SUCCESS('Счетчики сверены.'))
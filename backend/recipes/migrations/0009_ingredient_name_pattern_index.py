@@ -0,0 +1,33 @@
+from django.db import migrations
+
+# Фильтр name__istartswith на PostgreSQL превращается в
+# UPPER("name"::text) LIKE UPPER(...), поэтому индекс строится по тому же
+# выражению с text_pattern_ops, чтобы LIKE 'префикс%' использовал его
+# при любой локали базы.
+INDEX_NAME = 'recipes_ingredient_name_upper_like'
+
+
+def create_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        f'CREATE INDEX IF NOT EXISTS {INDEX_NAME} ON recipes_ingredient '
+        f'(UPPER(name::text) text_pattern_ops)'
+    )
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(f'DROP INDEX IF EXISTS {INDEX_NAME}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0008_shoppinglistitem'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
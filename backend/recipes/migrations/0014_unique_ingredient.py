@@ -0,0 +1,51 @@
+# Generated by Django 3.2.16 on 2026-10-18 02:20
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def merge_duplicates(apps, schema_editor):
+    """Сливает повторяющиеся ингредиенты в самый ранний перед ограничением.
+
+    Ссылки из рецептов и списков покупок переводятся на оставшийся
+    ингредиент, количества в списках покупок складываются.
+    """
+    Ingredient = apps.get_model('recipes', 'Ingredient')
+    IngredientsInRecipe = apps.get_model('recipes', 'IngredientsInRecipe')
+    ShoppingListItem = apps.get_model('recipes', 'ShoppingListItem')
+    duplicates = Ingredient.objects.values(
+        'name', 'measurement_unit'
+    ).annotate(keep=Min('id'), total=Count('id')).filter(total__gt=1)
+    for group in duplicates:
+        extra = list(Ingredient.objects.filter(
+            name=group['name'], measurement_unit=group['measurement_unit']
+        ).exclude(id=group['keep']).values_list('id', flat=True))
+        IngredientsInRecipe.objects.filter(ingredient_id__in=extra).update(
+            ingredient_id=group['keep']
+        )
+        for item in ShoppingListItem.objects.filter(ingredient_id__in=extra):
+            kept, created = ShoppingListItem.objects.get_or_create(
+                user_id=item.user_id,
+                ingredient_id=group['keep'],
+                defaults={'amount': item.amount}
+            )
+            if not created:
+                kept.amount += item.amount
+                kept.save(update_fields=('amount',))
+            item.delete()
+        Ingredient.objects.filter(id__in=extra).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0013_recipe_image_storage'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='ingredient',
+            constraint=models.UniqueConstraint(fields=('name', 'measurement_unit'), name='unique_ingredient'),
+        ),
+    ]
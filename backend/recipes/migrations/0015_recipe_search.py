@@ -0,0 +1,71 @@
+# Generated by Django 3.2.16 on 2026-10-18 02:22
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+# Индекс поддерживается RecipeQuerySet.update_search_index: на PostgreSQL
+# это поле search_vector с GIN-индексом, на SQLite - таблица FTS5.
+INDEX_NAME = 'recipes_recipe_search_vector_gin'
+FTS_TABLE = 'recipes_recipe_search'
+INGREDIENT_NAMES = (
+    "SELECT {aggregate} FROM recipes_ingredientsinrecipe item "
+    "JOIN recipes_ingredient ingredient "
+    "ON ingredient.id = item.ingredient_id "
+    "WHERE item.recipe_id = recipe.id"
+)
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        names = INGREDIENT_NAMES.format(
+            aggregate="string_agg(ingredient.name, ' ')"
+        )
+        schema_editor.execute(
+            f"UPDATE recipes_recipe recipe SET search_vector = "
+            f"setweight(to_tsvector('russian', recipe.name), 'A') || "
+            f"setweight(to_tsvector('russian', COALESCE(({names}), '')), "
+            f"'B') || "
+            f"setweight(to_tsvector('russian', recipe.text), 'C')"
+        )
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS {INDEX_NAME} ON recipes_recipe '
+            f'USING gin (search_vector)'
+        )
+    elif vendor == 'sqlite':
+        names = INGREDIENT_NAMES.format(
+            aggregate="group_concat(ingredient.name, ' ')"
+        )
+        schema_editor.execute(
+            f'CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} '
+            f'USING fts5(name, ingredients, text)'
+        )
+        schema_editor.execute(
+            f"INSERT INTO {FTS_TABLE} (rowid, name, ingredients, text) "
+            f"SELECT recipe.id, recipe.name, COALESCE(({names}), ''), "
+            f"recipe.text FROM recipes_recipe recipe"
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute(f'DROP INDEX IF EXISTS {INDEX_NAME}')
+    elif vendor == 'sqlite':
+        schema_editor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0014_unique_ingredient'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True, verbose_name='Поисковый вектор'),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
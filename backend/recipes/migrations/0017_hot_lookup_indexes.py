@@ -0,0 +1,63 @@
+# Generated by Django 3.2.16 on 2026-10-18 02:27
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+# Фильтр tags__slug идет от тега к рецептам, а автоматическая таблица
+# связи Recipe.tags индексирована только как (recipe_id, tag_id).
+RECIPE_TAGS_INDEX = 'recipes_recipe_tags_tag_recipe_idx'
+
+
+def merge_duplicate_ingredients(apps, schema_editor):
+    """Складывает повторяющиеся ингредиенты рецепта в одну строку."""
+    IngredientsInRecipe = apps.get_model('recipes', 'IngredientsInRecipe')
+    duplicates = IngredientsInRecipe.objects.values(
+        'recipe', 'ingredient'
+    ).annotate(
+        keep=Min('id'), total=Sum('amount'), rows=Count('id')
+    ).filter(rows__gt=1).order_by()
+    for group in duplicates:
+        IngredientsInRecipe.objects.filter(pk=group['keep']).update(
+            amount=group['total']
+        )
+        IngredientsInRecipe.objects.filter(
+            recipe=group['recipe'], ingredient=group['ingredient']
+        ).exclude(pk=group['keep']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0016_timelineentry'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            merge_duplicate_ingredients, migrations.RunPython.noop
+        ),
+        migrations.RunSQL(
+            f'CREATE INDEX {RECIPE_TAGS_INDEX} '
+            f'ON recipes_recipe_tags (tag_id, recipe_id)',
+            f'DROP INDEX {RECIPE_TAGS_INDEX}'
+        ),
+        migrations.AddIndex(
+            model_name='favourites',
+            index=models.Index(fields=['recipe', 'user'], name='favourites_recipe_user_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ingredientsinrecipe',
+            index=models.Index(fields=['ingredient', 'recipe'], name='ingredient_recipe_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['author', '-id'], name='recipe_author_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='shoppingcart',
+            index=models.Index(fields=['recipe', 'user'], name='cart_recipe_user_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='ingredientsinrecipe',
+            constraint=models.UniqueConstraint(fields=('recipe', 'ingredient'), name='unique_ingredient_in_recipe'),
+        ),
+    ]
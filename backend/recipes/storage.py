@@ -0,0 +1,44 @@
+import hashlib
+import os
+
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+HASH_CHUNK_SIZE = 64 * 1024
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """Хранилище, в котором имя файла - хэш его содержимого.
+
+    Повторная загрузка той же картинки не пишет файл заново, а только
+    обновляет время его изменения, чтобы сборщик мусора не удалил файл,
+    на который вот-вот сошлется новый рецепт. Сколько рецептов ссылается
+    на файл, знает только база, поэтому файлы удаляются не при удалении
+    рецепта, а командой collect_recipe_images.
+    """
+
+    def content_name(self, name, content):
+        digest = hashlib.sha256()
+        for chunk in content.chunks(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+        content.seek(0)
+        directory, filename = os.path.split(name)
+        ext = os.path.splitext(filename)[1].lower()
+        return os.path.join(directory, f'{digest.hexdigest()[:32]}{ext}')
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        name = self.content_name(name, content)
+        if self.exists(name):
+            os.utime(self.path(name))
+            return name
+        return super().save(name, content, max_length)
+
+    def save_derived(self, name, content):
+        """Сохраняет производный файл, например копию картинки, под name."""
+        return super().save(name, content)
+
+
+recipe_image_storage = ContentAddressedStorage()
@@ -0,0 +1,163 @@
+from django.test import TestCase, override_settings
+
+from users.models import Follow, User
+
+from .models import (Ingredient, IngredientsInRecipe, Recipe, ShoppingCart,
+                     ShoppingListItem, TimelineEntry)
+
+
+def create_recipe(author, amounts, name='Рецепт'):
+    """Рецепт с ингредиентами amounts = {ингредиент: количество}."""
+    recipe = Recipe.objects.create(
+        author=author, name=name, text='Описание', cooking_time=5,
+        image='recipes/test.png'
+    )
+    IngredientsInRecipe.objects.bulk_create(
+        IngredientsInRecipe(
+            recipe=recipe, ingredient=ingredient, amount=amount
+        )
+        for ingredient, amount in amounts.items()
+    )
+    return recipe
+
+
+class ShoppingListItemTests(TestCase):
+    """Материализованные списки покупок."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='buyer', email='buyer@test.ru', password='pass'
+        )
+        cls.author = User.objects.create_user(
+            username='author', email='author@test.ru', password='pass'
+        )
+        cls.flour = Ingredient.objects.create(
+            name='мука', measurement_unit='г'
+        )
+        cls.milk = Ingredient.objects.create(
+            name='молоко', measurement_unit='мл'
+        )
+
+    def get_amounts(self):
+        return dict(
+            ShoppingListItem.objects.filter(user=self.user).values_list(
+                'ingredient_id', 'amount'
+            )
+        )
+
+    def test_add_amounts_upserts_existing_rows(self):
+        ShoppingListItem.objects.add_amounts([
+            (self.user.id, self.flour.id, 100),
+            (self.user.id, self.milk.id, 50),
+        ])
+        ShoppingListItem.objects.add_amounts([
+            (self.user.id, self.flour.id, 20),
+        ])
+        self.assertEqual(
+            self.get_amounts(), {self.flour.id: 120, self.milk.id: 50}
+        )
+
+    def test_subtract_amounts_clamps_and_deletes_empty_rows(self):
+        ShoppingListItem.objects.add_amounts([
+            (self.user.id, self.flour.id, 100),
+            (self.user.id, self.milk.id, 50),
+        ])
+        ShoppingListItem.objects.subtract_amounts(
+            (self.user.id,), {self.flour.id: 30, self.milk.id: 80}
+        )
+        self.assertEqual(self.get_amounts(), {self.flour.id: 70})
+
+    def test_add_and_remove_recipe(self):
+        first = create_recipe(self.author, {self.flour: 100, self.milk: 50})
+        second = create_recipe(self.author, {self.flour: 200})
+        ShoppingListItem.objects.add_recipe((self.user.id,), first)
+        ShoppingListItem.objects.add_recipe((self.user.id,), second)
+        self.assertEqual(
+            self.get_amounts(), {self.flour.id: 300, self.milk.id: 50}
+        )
+        ShoppingListItem.objects.remove_recipe((self.user.id,), first)
+        self.assertEqual(self.get_amounts(), {self.flour.id: 200})
+
+    def test_rebuild_follows_carts(self):
+        recipe = create_recipe(self.author, {self.flour: 100})
+        ShoppingCart.objects.create(user=self.user, recipe=recipe)
+        ShoppingListItem.objects.add_amounts([
+            (self.user.id, self.milk.id, 10),
+        ])
+        ShoppingListItem.objects.rebuild((self.user.id,))
+        self.assertEqual(self.get_amounts(), {self.flour.id: 100})
+
+    def test_deleting_recipe_rebuilds_lists(self):
+        recipe = create_recipe(self.author, {self.flour: 100})
+        ShoppingCart.objects.create(user=self.user, recipe=recipe)
+        ShoppingListItem.objects.rebuild((self.user.id,))
+        recipe.delete()
+        self.assertEqual(self.get_amounts(), {})
+
+
+class TimelineEntryTests(TestCase):
+    """Ленты подписок."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader = User.objects.create_user(
+            username='reader', email='reader@test.ru', password='pass'
+        )
+        cls.author = User.objects.create_user(
+            username='author', email='author@test.ru', password='pass'
+        )
+
+    def create_recipe(self):
+        recipe = create_recipe(self.author, {})
+        TimelineEntry.objects.fan_out(recipe)
+        return recipe
+
+    def get_feed(self):
+        return TimelineEntry.objects.recipe_ids(self.reader, 100)
+
+    def test_fan_out_to_followers(self):
+        Follow.objects.create(user=self.reader, author=self.author)
+        recipe = self.create_recipe()
+        self.assertTrue(recipe.fanned_out)
+        self.assertTrue(TimelineEntry.objects.filter(
+            user=self.reader, recipe=recipe
+        ).exists())
+
+    @override_settings(RECIPE_FEED_BACKFILL=2)
+    def test_backfill_and_trim(self):
+        recipes = [self.create_recipe() for _ in range(3)]
+        Follow.objects.create(user=self.reader, author=self.author)
+        TimelineEntry.objects.backfill(self.reader, self.author)
+        self.assertEqual(
+            list(TimelineEntry.objects.filter(user=self.reader).order_by(
+                '-recipe_id'
+            ).values_list('recipe_id', flat=True)),
+            [recipe.id for recipe in recipes[:0:-1]]
+        )
+        TimelineEntry.objects.trim(self.reader, self.author)
+        self.assertFalse(
+            TimelineEntry.objects.filter(user=self.reader).exists()
+        )
+
+    @override_settings(RECIPE_FEED_FANOUT_LIMIT=1)
+    def test_popular_author_recipes_are_pulled(self):
+        Follow.objects.create(user=self.reader, author=self.author)
+        User.objects.filter(pk=self.author.pk).update(followers_count=1)
+        recipe = self.create_recipe()
+        self.assertFalse(recipe.fanned_out)
+        self.assertFalse(TimelineEntry.objects.exists())
+        self.assertEqual(self.get_feed(), [recipe.id])
+
+    def test_recipe_ids_merges_entries_and_pulled_recipes(self):
+        Follow.objects.create(user=self.reader, author=self.author)
+        fanned_out = self.create_recipe()
+        pulled = create_recipe(self.author, {})
+        self.assertEqual(self.get_feed(), [pulled.id, fanned_out.id])
+        self.assertEqual(
+            TimelineEntry.objects.recipe_ids(self.reader, 1), [pulled.id]
+        )
+        self.assertEqual(
+            TimelineEntry.objects.recipe_ids(self.reader, 10, pulled.id),
+            [fanned_out.id]
+        )
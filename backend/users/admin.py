@@ -9,7 +9,9 @@ class UserAdmin(admin.ModelAdmin):
         'username',
         'email',
         'first_name',
-        'last_name'
+        'last_name',
+        'recipes_count',
+        'followers_count'
     )
     search_fields = ('username', 'first_name')
     list_filter = ('username', 'first_name')
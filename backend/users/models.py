@@ -1,6 +1,54 @@
-from django.contrib.auth.models import AbstractUser
+from django.contrib.auth.models import AbstractUser, UserManager
 from django.contrib.auth.validators import UnicodeUsernameValidator
 from django.db import models
+from django.db.models import Count, Exists, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+
+SEARCH_FIELDS = ('username', 'first_name', 'last_name')
+
+
+class UserQuerySet(models.QuerySet):
+
+    def with_is_subscribed(self, user):
+        """Флаг is_subscribed текущего пользователя через подзапрос Exists."""
+        if user.is_anonymous:
+            return self.annotate(
+                is_subscribed=Value(False, output_field=models.BooleanField())
+            )
+        return self.annotate(is_subscribed=Exists(Follow.objects.filter(
+            user=user, author=OuterRef('pk')
+        )))
+
+    def recount_followers(self):
+        """Пересчитывает followers_count по таблице подписок."""
+        return self.update(followers_count=Coalesce(Subquery(
+            Follow.objects.filter(author=OuterRef('pk')).order_by(
+            ).values('author').annotate(total=Count('pk')).values('total')
+        ), 0))
+
+    def followed_by(self, user):
+        """Авторы, на которых подписан пользователь, по логину."""
+        return self.filter(following__user=user).annotate(
+            is_subscribed=Value(True, output_field=models.BooleanField())
+        ).order_by('username')
+
+    def search(self, query):
+        """Пользователи, у которых каждое слово query есть в логине или имени.
+
+        На PostgreSQL поиск по подстроке обслуживают триграммные индексы
+        из миграции 0006_user_search_indexes.
+        """
+        condition = Q()
+        for term in query.split():
+            term_condition = Q()
+            for field in SEARCH_FIELDS:
+                term_condition |= Q(**{f'{field}__icontains': term})
+            condition &= term_condition
+        return self.filter(condition)
+
+
+class CustomUserManager(UserManager.from_queryset(UserQuerySet)):
+    pass
 
 
 class User(AbstractUser):
@@ -31,6 +79,18 @@ class User(AbstractUser):
         'Пароль',
         max_length=150
     )
+    recipes_count = models.PositiveIntegerField(
+        'Количество рецептов',
+        default=0,
+        editable=False
+    )
+    followers_count = models.PositiveIntegerField(
+        'Количество подписчиков',
+        default=0,
+        editable=False
+    )
+
+    objects = CustomUserManager()
 
     class Meta:
         ordering = ('username',)
@@ -68,6 +128,11 @@ class Follow(models.Model):
                 name='Вы не можете подписаться на себя!',
             )
         )
+        indexes = (
+            models.Index(
+                fields=('author', 'user'), name='follow_author_user_idx'
+            ),
+        )
 
     def __str__(self):
         return f'{self.user.username} подписан на {self.author.username}'
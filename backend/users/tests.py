@@ -0,0 +1,58 @@
+from django.test import TestCase
+
+from recipes.models import Favourites, Recipe
+
+from .models import Follow, User
+
+
+class UserCountersTests(TestCase):
+    """Счетчики рецептов и подписчиков."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader = User.objects.create_user(
+            username='reader', email='reader@test.ru', password='pass'
+        )
+        cls.author = User.objects.create_user(
+            username='author', email='author@test.ru', password='pass'
+        )
+
+    def create_recipe(self):
+        return Recipe.objects.create(
+            author=self.author, name='Рецепт', text='Описание',
+            cooking_time=5, image='recipes/test.png'
+        )
+
+    def get_author(self):
+        return User.objects.get(pk=self.author.pk)
+
+    def test_recipes_count_follows_recipes(self):
+        recipe = self.create_recipe()
+        self.create_recipe()
+        self.assertEqual(self.get_author().recipes_count, 2)
+        recipe.delete()
+        self.assertEqual(self.get_author().recipes_count, 1)
+
+    def test_recount_followers(self):
+        Follow.objects.create(user=self.reader, author=self.author)
+        User.objects.filter(pk=self.author.pk).update(followers_count=5)
+        User.objects.filter(pk=self.author.pk).recount_followers()
+        self.assertEqual(self.get_author().followers_count, 1)
+
+    def test_deleting_user_recounts_counters(self):
+        recipe = self.create_recipe()
+        Follow.objects.create(user=self.reader, author=self.author)
+        Favourites.objects.create(user=self.reader, recipe=recipe)
+        Recipe.objects.filter(pk=recipe.pk).recount_favourites()
+        User.objects.filter(pk=self.author.pk).recount_followers()
+        self.reader.delete()
+        self.assertEqual(self.get_author().followers_count, 0)
+        self.assertEqual(
+            Recipe.objects.get(pk=recipe.pk).favourites_count, 0
+        )
+
+    def test_followed_by_annotates_is_subscribed(self):
+        Follow.objects.create(user=self.reader, author=self.author)
+        authors = list(User.objects.followed_by(self.reader))
+        self.assertEqual(authors, [self.author])
+        self.assertTrue(authors[0].is_subscribed)